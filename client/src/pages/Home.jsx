@@ -1,16 +1,10 @@
 import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import Button from '../components/Button';
-import axios from 'axios';
 import './Home.css';
 import { Camera } from 'lucide-react';
 import CameraModal from '../components/CameraModal';
 
-// Google cloud backend server
-// const API_URL = 'https://find-me-backend-service-933492600521.us-central1.run.app/classify-and-match/';
-
-const API_URL = 'http://localhost:8000/classify-and-match/';
-
 const Home = () => {
   const [targetImage, setTargetImage] = useState(null);
   const [galleryImages, setGalleryImages] = useState([]);
@@ -53,38 +47,14 @@ const Home = () => {
       return;
     }
 
-    const formData = new FormData();
-    formData.append('target_image', targetImage);
-    galleryImages.forEach(file => {
-      formData.append('gallery_images', file);
-    });
-
-    try {
-      const response = await axios.post(API_URL, formData, {
-        headers: {
-          'Authorization': `Bearer ${token}`,
-        },
-      });
-      
-      navigate('/result', { 
-        state: { 
-          apiResponse: response.data,
-          originalImages: galleryImages 
-        } 
-      });
-
-    } catch (err) {
-      console.error("API Error:", err);
-      if (err.response?.status === 401) {
-        setError("Your session has expired. Please log in again.");
-        localStorage.removeItem('userToken');
-        navigate('/login');
-      } else {
-        setError(err.response?.data?.detail || "An unexpected error occurred. Please try again.");
+    // Results are streamed on the Result page so matches render as soon as they are found
+    navigate('/result', {
+      state: {
+        streamRequest: { targetImage, galleryImages },
+        originalImages: galleryImages
       }
-    } finally {
-      setIsLoading(false);
-    }
+    });
+    setIsLoading(false);
   };
 
   // camera model
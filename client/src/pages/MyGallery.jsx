@@ -1,40 +1,55 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import axios from 'axios';
 import './MyGallery.css';
 
 const API_URL = 'http://localhost:8000';
+const PAGE_SIZE = 20;
+
+// Backend-rendered thumbnail of an image in a stored result (older results have none)
+const thumbnailFor = (result, url) => result.thumbnails?.find(t => t.url === url)?.thumbnail_url || url;
 
 export default function MyGallery() {
   const [results, setResults] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
 
-  useEffect(() => {
+  // Results come one page at a time, newest first; nextCursor is null on the last page
+  const loadPage = useCallback(async (cursor) => {
     const token = localStorage.getItem('userToken');
     if (!token) {
       setError('Not authenticated');
       return;
     }
-    (async () => {
-      try {
-        const res = await axios.get(`${API_URL}/results`, {
-          headers: { Authorization: `Bearer ${token}` },
-        });
-        setResults(res.data || []);
-      } catch (err) {
-        setError(err.response?.data?.detail || 'Failed to load results');
-      }
-    })();
+    setLoading(true);
+    try {
+      const res = await axios.get(`${API_URL}/results`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      });
+      const items = res.data?.items || [];
+      setResults(prev => (cursor ? [...prev, ...items] : items));
+      setNextCursor(res.data?.next_cursor || null);
+    } catch (err) {
+      setError(err.response?.data?.detail || 'Failed to load results');
+    } finally {
+      setLoading(false);
+    }
   }, []);
 
+  useEffect(() => {
+    loadPage(null);
+  }, [loadPage]);
+
   return (
     <div className="my-results-page">
       <h2>Previous Results</h2>
       {error && <p className="error">{error}</p>}
       {results.length === 0 ? (
-        <p>No results yet.</p>
+        <p>{loading ? 'Loading...' : 'No results yet.'}</p>
       ) : (
         results.map(r => (
-          <div key={r.id} className="result-card">
+          <div key={r._id || r.id} className="result-card">
             <div className="meta">
               <strong>When:</strong> {new Date(r.created_at).toLocaleString()}
             </div>
@@ -42,12 +57,21 @@ export default function MyGallery() {
             <div>
               <strong>Matches:</strong>
               <div className="thumb-list">
-                {r.matched_images?.map((u, i) => <img key={i} src={u} alt={`match-${i}`} className="thumb" />)}
+                {r.matched_images?.map((u, i) => (
+                  <a key={i} href={u} target="_blank" rel="noreferrer">
+                    <img src={thumbnailFor(r, u)} alt={`match-${i}`} className="thumb" loading="lazy" />
+                  </a>
+                ))}
               </div>
             </div>
           </div>
         ))
       )}
+      {nextCursor && (
+        <button className="load-more" onClick={() => loadPage(nextCursor)} disabled={loading}>
+          {loading ? 'Loading...' : 'Load more'}
+        </button>
+      )}
     </div>
   );
 }
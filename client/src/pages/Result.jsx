@@ -1,27 +1,125 @@
-import React, { useMemo, useEffect } from 'react';
+import React, { useMemo, useEffect, useState } from 'react';
 import { useLocation, Link, useNavigate } from 'react-router-dom';
 import './Result.css';
-import Home from './Home';
 import Button from '../components/Button';
 
+// Google cloud backend server
+// const STREAM_URL = 'https://find-me-backend-service-933492600521.us-central1.run.app/classify-and-match/stream';
+
+const STREAM_URL = 'http://localhost:8000/classify-and-match/stream';
+
+// Reads an NDJSON response body and calls onEvent for every complete line
+const readNdjson = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.filter(Boolean).forEach(line => onEvent(JSON.parse(line)));
+  }
+  if (buffer.trim()) onEvent(JSON.parse(buffer));
+};
+
 const Result = () => {
   const { state } = useLocation();
   const navigate = useNavigate();
+  const [streamedResponse, setStreamedResponse] = useState(null);
+  const [streamStatus, setStreamStatus] = useState({ processed: 0, total: 0, done: false, error: null });
+
+  // Streaming mode: run the search here and render each image as soon as it is classified
+  useEffect(() => {
+    const request = state?.streamRequest;
+    if (!request) return;
+
+    const token = localStorage.getItem('userToken');
+    if (!token) {
+      navigate('/login');
+      return;
+    }
+
+    const controller = new AbortController();
+    const formData = new FormData();
+    formData.append('target_image', request.targetImage);
+    request.galleryImages.forEach(file => formData.append('gallery_images', file));
+
+    const partial = { matched_images: [], unmatched_images_with_people: [], images_without_people: [], match_scores: [], thumbnails: [] };
+    const buckets = {
+      matched: 'matched_images',
+      unmatched_with_people: 'unmatched_images_with_people',
+      without_people: 'images_without_people',
+    };
+
+    (async () => {
+      try {
+        const response = await fetch(STREAM_URL, {
+          method: 'POST',
+          headers: { Authorization: `Bearer ${token}` },
+          body: formData,
+          signal: controller.signal,
+        });
+        if (response.status === 401) {
+          localStorage.removeItem('userToken');
+          navigate('/login');
+          return;
+        }
+        if (!response.ok) throw new Error(`Request failed (${response.status})`);
+
+        await readNdjson(response, (event) => {
+          if (event.type === 'target') {
+            setStreamStatus(s => ({ ...s, total: event.total }));
+          } else if (event.type === 'image') {
+            partial[buckets[event.bucket]] = [...partial[buckets[event.bucket]], event.url];
+            if (event.distance !== null) {
+              partial.match_scores = [...partial.match_scores, { url: event.url, distance: event.distance }];
+            }
+            if (event.thumbnail_url) {
+              partial.thumbnails = [...partial.thumbnails, { url: event.url, thumbnail_url: event.thumbnail_url }];
+            }
+            setStreamedResponse({ ...partial });
+            setStreamStatus(s => ({ ...s, processed: s.processed + 1 }));
+          } else if (event.type === 'result') {
+            // Final, ranked response replaces the incremental one. Swap it into the history
+            // entry too, so a reload or back navigation re-renders it instead of re-uploading
+            setStreamedResponse(event);
+            setStreamStatus(s => ({ ...s, done: true }));
+            navigate('/result', { replace: true, state: { apiResponse: event, originalImages: state.originalImages } });
+          } else if (event.type === 'error') {
+            setStreamStatus(s => ({ ...s, done: true, error: event.detail }));
+          }
+        });
+      } catch (err) {
+        if (err.name !== 'AbortError') {
+          console.error("API Error:", err);
+          setStreamStatus(s => ({ ...s, done: true, error: err.message || 'An unexpected error occurred.' }));
+        }
+      }
+    })();
+
+    return () => controller.abort();
+  }, [state, navigate]);
 
   const { matchedImages, unmatchedWithPeople, withoutPeople } = useMemo(() => {
-    if (!state?.apiResponse) {
+    const apiResponse = state?.apiResponse || streamedResponse;
+    if (!apiResponse) {
       return { matchedImages: [], unmatchedWithPeople: [], withoutPeople: [] };
     }
 
-    const { apiResponse, originalImages } = state || {};
+    const { originalImages } = state || {};
     // Map local files by name for local previews
     const imageMap = new Map((originalImages || []).map(file => [file.name, URL.createObjectURL(file)]));
 
+    // Compact thumbnails rendered by the backend; the grid links to the full-size original
+    const thumbnailByUrl = new Map((apiResponse.thumbnails || []).map(t => [t.url, t.thumbnail_url]));
+
     const mapItem = (item, idx) => {
       if (!item) return null;
       // If backend returned a URL, use it directly
       if (typeof item === 'string' && (item.startsWith('http://') || item.startsWith('https://'))) {
-        return { name: item.split('/').pop() || `image-${idx}`, url: item, isLocal: false };
+        return { name: item.split('/').pop() || `image-${idx}`, url: item, thumb: thumbnailByUrl.get(item), isLocal: false };
       }
       // Otherwise try to resolve to a local file preview
       const url = imageMap.get(item);
@@ -30,12 +128,17 @@ const Result = () => {
       return { name: String(item), url: null, isLocal: false };
     };
 
-    const matched = (apiResponse.matched_images || []).map(mapItem).filter(i => i.url);
+    // Distance scores from the backend (lower = closer match); matched_images is already ranked
+    const distanceByUrl = new Map((apiResponse.match_scores || []).map(s => [s.url, s.distance]));
+    const matched = (apiResponse.matched_images || [])
+      .map(mapItem)
+      .filter(i => i.url)
+      .map(i => ({ ...i, distance: distanceByUrl.get(i.url) }));
     const unmatched = (apiResponse.unmatched_images_with_people || []).map(mapItem).filter(i => i.url);
     const noPeople = (apiResponse.images_without_people || []).map(mapItem).filter(i => i.url);
 
     return { matchedImages: matched, unmatchedWithPeople: unmatched, withoutPeople: noPeople };
-  }, [state]);
+  }, [state, streamedResponse]);
 
   useEffect(() => {
     // Revoke only local object URLs (created from File objects)
@@ -59,14 +162,20 @@ const Result = () => {
   return (
     <div className='home-container'>
       <h1>Classification Results</h1>
+      {state.streamRequest && !streamStatus.done && (
+        <p>Processing... {streamStatus.processed} / {streamStatus.total || state.streamRequest.galleryImages.length} images</p>
+      )}
+      {streamStatus.error && <p className="error-message">{streamStatus.error}</p>}
       
       <div className='results-section'>
         <h2 className='section-title'>Matched Images ({matchedImages.length})</h2>
         <div className='upload-box gallery-box'>
           {matchedImages.length > 0 ? (
             matchedImages.map((image) => (
-              <div key={image.name} className='image-preview-wrapper'>
-                <img src={image.url} alt={image.name} className='preview-image' />
+              <div key={image.name} className='image-preview-wrapper' title={image.distance !== undefined ? `distance ${image.distance}` : undefined}>
+                <a href={image.url} target='_blank' rel='noreferrer'>
+                  <img src={image.thumb || image.url} alt={image.name} className='preview-image' loading='lazy' />
+                </a>
               </div>
             ))
           ) : (
@@ -81,7 +190,9 @@ const Result = () => {
           {unmatchedWithPeople.length > 0 ? (
             unmatchedWithPeople.map((image) => (
               <div key={image.name} className='image-preview-wrapper'>
-                <img src={image.url} alt={image.name} className='preview-image' />
+                <a href={image.url} target='_blank' rel='noreferrer'>
+                  <img src={image.thumb || image.url} alt={image.name} className='preview-image' loading='lazy' />
+                </a>
               </div>
             ))
           ) : (
@@ -96,7 +207,9 @@ const Result = () => {
           {withoutPeople.length > 0 ? (
             withoutPeople.map((image) => (
               <div key={image.name} className='image-preview-wrapper'>
-                <img src={image.url} alt={image.name} className='preview-image' />
+                <a href={image.url} target='_blank' rel='noreferrer'>
+                  <img src={image.thumb || image.url} alt={image.name} className='preview-image' loading='lazy' />
+                </a>
               </div>
             ))
           ) : (
@@ -0,0 +1,451 @@
+"""
+Offline benchmark for the matching pipeline.
+
+    python benchmark.py --synthetic --count 200 --width 4000 --height 3000
+    python benchmark.py --source ./photos --target ./me.jpg --mode endpoint --requests 5
+    python benchmark.py --synthetic --count 50 --output bench.json   # machine-readable result
+
+Modes:
+  stages   (default) the server's search pipeline (main.classify_uploads: encoding pool,
+           embedding cache, thumbnails, storage, db) called in-process, timed per stage
+  endpoint POST /classify-and-match/ end to end through FastAPI's TestClient
+
+Storage goes to a temporary local directory and MongoDB is replaced by an in-memory
+stand-in, so nothing leaves the machine. Requires face_recognition (dlib) like the server.
+Synthetic galleries paste faces cropped from --faces-dir (default: ./uploads) onto
+generated backgrounds; without any faces found there every image is face-free.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# main.py reads its settings at import time
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# IN-MEMORY MONGO STAND-IN
+# Just enough of the motor API for the collections main.py uses.
+
+def _matches(doc: Dict, query: Dict) -> bool:
+    for field, cond in query.items():
+        value = doc.get(field)
+        if isinstance(cond, dict) and any(k.startswith("$") for k in cond):
+            for op, arg in cond.items():
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+                if op == "$lt" and not (value is not None and value < arg):
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+class _Cursor:
+    def __init__(self, docs: List[Dict]):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            key, direction = key[0]
+        self._docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, n: int):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return self._docs[:length] if length else list(self._docs)
+
+class _Result:
+    def __init__(self, inserted_id=None, upserted_id=None, modified_count=0):
+        self.inserted_id = inserted_id
+        self.upserted_id = upserted_id
+        self.modified_count = modified_count
+
+class InMemoryCollection:
+    def __init__(self):
+        self.docs: Dict = {}
+
+    def _project(self, doc: Dict, projection: Optional[Dict]) -> Dict:
+        if not projection:
+            return dict(doc)
+        included = {k for k, v in projection.items() if v}
+        if included:
+            return {k: v for k, v in doc.items() if k in included or k == "_id"}
+        return {k: v for k, v in doc.items() if k not in projection}
+
+    def find(self, query: Optional[Dict] = None, projection: Optional[Dict] = None, **_):
+        docs = [self._project(d, projection) for d in self.docs.values() if _matches(d, query or {})]
+        return _Cursor(docs)
+
+    async def find_one(self, query: Optional[Dict] = None, projection: Optional[Dict] = None, **_):
+        for doc in self.docs.values():
+            if _matches(doc, query or {}):
+                return self._project(doc, projection)
+        return None
+
+    async def insert_one(self, doc: Dict):
+        from bson import ObjectId
+
+        doc.setdefault("_id", ObjectId())
+        self.docs[doc["_id"]] = doc
+        return _Result(inserted_id=doc["_id"])
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                self._apply(doc, update, inserting=False)
+                return _Result(modified_count=1)
+        if not upsert:
+            return _Result()
+        from bson import ObjectId
+
+        doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+        doc.setdefault("_id", ObjectId())
+        self._apply(doc, update, inserting=True)
+        self.docs[doc["_id"]] = doc
+        return _Result(upserted_id=doc["_id"])
+
+    async def update_many(self, query: Dict, update: Dict):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                self._apply(doc, update, inserting=False)
+        return _Result()
+
+    def _apply(self, doc: Dict, update: Dict, inserting: bool) -> None:
+        doc.update(update.get("$set", {}))
+        if inserting:
+            doc.update(update.get("$setOnInsert", {}))
+        for field, value in update.get("$addToSet", {}).items():
+            values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+            current = doc.setdefault(field, [])
+            current.extend(v for v in values if v not in current)
+
+    async def bulk_write(self, ops, ordered: bool = True):
+        for op in ops:
+            await self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+    async def create_index(self, *args, **kwargs):
+        return None
+
+    async def count_documents(self, query: Dict):
+        return sum(1 for d in self.docs.values() if _matches(d, query))
+
+class _InMemoryAdmin:
+    async def command(self, *args, **kwargs):
+        return {"ok": 1}
+
+class InMemoryClient:
+    admin = _InMemoryAdmin()
+
+def install_stand_ins(main, storage_dir: str) -> None:
+    """Point main.py at the in-memory DB and a local storage directory."""
+    from image_store import ImageStore, LocalStorageBackend
+
+    main.client = InMemoryClient()
+    for name in dir(main):
+        if name.endswith("_collection"):
+            setattr(main, name, InMemoryCollection())
+    main.image_store = ImageStore(
+        LocalStorageBackend(storage_dir, "http://benchmark"),
+        max_workers=main.settings.STORAGE_MAX_WORKERS,
+        observer=main.metrics.observe_storage,
+    )
+
+# GALLERY
+
+def _encode_jpeg(image: Image.Image, quality: int = 90) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def _image_paths(directory: str) -> List[str]:
+    """Image files under directory (recursive), sorted."""
+    paths = []
+    for root, _, names in os.walk(directory):
+        paths.extend(os.path.join(root, n) for n in names if os.path.splitext(n)[1].lower() in IMAGE_EXTENSIONS)
+    return sorted(paths)
+
+def load_gallery(source: str, count: Optional[int]) -> List[Tuple[str, bytes]]:
+    paths = _image_paths(source)
+    if not paths:
+        raise SystemExit(f"No images found in {source}")
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+    if count:
+        # Cycle to the requested size; repeated bytes hit the embedding cache in warm runs
+        files = [(f"{i}_{files[i % len(files)][0]}", files[i % len(files)][1]) for i in range(count)]
+    return files
+
+def _face_crops(faces_dir: str, limit: int = 32) -> List[Image.Image]:
+    import face_recognition
+
+    crops = []
+    for path in _image_paths(faces_dir) if os.path.isdir(faces_dir) else []:
+        image = Image.open(path).convert("RGB")
+        image.thumbnail((1200, 1200))
+        for top, right, bottom, left in face_recognition.face_locations(np.asarray(image)):
+            # Pad the box: the HOG detector needs some context around the face
+            pad = (bottom - top) // 2
+            box = (max(0, left - pad), max(0, top - pad), min(image.width, right + pad), min(image.height, bottom + pad))
+            crops.append(image.crop(box))
+            if len(crops) >= limit:
+                return crops
+    return crops
+
+def synthetic_gallery(
+    count: int,
+    width: int,
+    height: int,
+    face_density: float,
+    faces_per_image: int,
+    faces_dir: str,
+    seed: int = 0,
+) -> Tuple[List[Tuple[str, bytes]], Optional[bytes]]:
+    """
+    count images of width x height; a face_density fraction of them get faces_per_image
+    faces pasted in. Returns (gallery, target) where target is the first face crop.
+    """
+    rng = np.random.default_rng(seed)
+    crops = _face_crops(faces_dir)
+    if not crops:
+        print(f"Warning: no faces found in {faces_dir}; synthetic images will contain no faces", file=sys.stderr)
+
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    gallery = []
+    for i in range(count):
+        base = rng.integers(0, 255, size=3).astype(np.float32)
+        pixels = (gradient * 0.3 + base * 0.7 + rng.normal(0, 12, size=(height, 1, 3))).clip(0, 255)
+        image = Image.fromarray(np.broadcast_to(pixels, (height, width, 3)).astype(np.uint8))
+        if crops and rng.random() < face_density:
+            for _ in range(faces_per_image):
+                crop = crops[rng.integers(len(crops))]
+                size = int(min(width, height) * rng.uniform(0.15, 0.35))
+                face = crop.resize((size, int(size * crop.height / crop.width)))
+                x = int(rng.integers(0, max(1, width - face.width)))
+                y = int(rng.integers(0, max(1, height - face.height)))
+                image.paste(face, (x, y))
+        gallery.append((f"synthetic_{i}.jpg", _encode_jpeg(image)))
+    target = _encode_jpeg(crops[0]) if crops else None
+    return gallery, target
+
+# MEASUREMENT
+
+def _summary(values: List[float], total: bool = True) -> Dict[str, float]:
+    """Distribution of durations; total=False for values that do not add up (e.g. timestamps)."""
+    if not values:
+        return {"count": 0}
+    arr = np.asarray(values) * 1000.0
+    return {
+        "count": len(values),
+        **({"total_s": round(float(arr.sum()) / 1000.0, 4)} if total else {}),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+
+def _vm_hwm_mb(pid: int) -> Optional[float]:
+    """Peak RSS of a live process from /proc (Linux); None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024.0, 1) # kB
+    except OSError:
+        pass
+    return None
+
+def peak_rss_mb(pool_pids: List[int]) -> Dict:
+    """
+    Peak RSS of this process and of the encoding pool's processes (decode / detect /
+    encode run there). Pool processes are children of the fork server, not of this
+    process, so RUSAGE_CHILDREN never sees them; their high-water marks are read from
+    /proc while they are still alive.
+    """
+    workers = [mb for mb in (_vm_hwm_mb(pid) for pid in pool_pids) if mb is not None]
+    return {
+        # ru_maxrss is KiB on Linux
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        "pool_worker_max": max(workers) if workers else None,
+        "pool_workers_total": round(sum(workers), 1) if workers else None,
+    }
+
+@contextlib.contextmanager
+def _recording(histogram):
+    """Collect every value observed on a metrics Histogram, by stage label, while active."""
+    recorded: Dict[str, List[float]] = {}
+    observe = histogram.observe
+
+    def record(value: float, **labels):
+        recorded.setdefault(labels.get("stage", ""), []).append(value)
+        observe(value, **labels)
+
+    histogram.observe = record
+    try:
+        yield recorded
+    finally:
+        del histogram.observe
+
+def run_stages(main, gallery: List[Tuple[str, bytes]], target: bytes) -> Dict:
+    """
+    Search the gallery once through main.classify_uploads, the pipeline behind the search
+    endpoints, and report the time every stage took and when each image was decided.
+    """
+    from fastapi import UploadFile
+
+    uploads = [UploadFile(file=io.BytesIO(content), filename=filename) for filename, content in gallery]
+    decided: List[float] = []
+
+    async def search():
+        started = time.perf_counter()
+
+        async def on_image(event: Dict):
+            decided.append(time.perf_counter() - started)
+
+        results = await main.classify_uploads([target], uploads, "benchmark", on_image=on_image)
+        await main.save_result_for_user("benchmark", results)
+        return results, time.perf_counter() - started
+
+    with _recording(main.metrics.STAGE_SECONDS) as stage_times, _recording(main.metrics.FACES_PER_IMAGE) as faces:
+        results, wall = asyncio.run(search())
+
+    return {
+        "wall_s": round(wall, 4),
+        "images_per_sec": round(len(gallery) / wall, 3) if wall else None,
+        "first_image_s": round(min(decided), 4) if decided else None,
+        "faces_found": int(sum(faces.get("", []))),
+        "matches": len(results["matched_images"]),
+        "stages": {stage: _summary(values) for stage, values in sorted(stage_times.items())},
+        "decided_after": _summary(decided, total=False),
+    }
+
+def run_endpoint(main, gallery: List[Tuple[str, bytes]], target: bytes, requests: int, warm: bool) -> Dict:
+    """POST the gallery `requests` times and time each full request."""
+    from fastapi.testclient import TestClient
+
+    latencies = []
+    with TestClient(main.app) as client:
+        client.post("/signup", json={"username": "bench", "email": "bench@example.com", "address": "-", "password": "bench"})
+        token = client.post("/login", data={"username": "bench@example.com", "password": "bench"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        files = [("target_image", ("target.jpg", target))] + [("gallery_images", (name, content)) for name, content in gallery]
+        for _ in range(requests):
+            if not warm:
+                main.embeddings_collection.docs.clear()
+            t0 = time.perf_counter()
+            response = client.post("/classify-and-match/", files=files, headers=headers)
+            latencies.append(time.perf_counter() - t0)
+            response.raise_for_status()
+        matches = len(response.json()["matched_images"])
+
+    total = sum(latencies)
+    return {
+        "requests": requests,
+        "warm_cache": warm,
+        "images_per_sec": round(len(gallery) * requests / total, 3) if total else None,
+        "matches": matches,
+        "latency_per_request": _summary(latencies),
+    }
+
+def main_cli(argv: Optional[List[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Benchmark the FindMe matching pipeline (offline).")
+    parser.add_argument("--mode", choices=("stages", "endpoint"), default="stages")
+    parser.add_argument("--source", help="directory of gallery images to load")
+    parser.add_argument("--target", help="target image (default: first gallery image / first synthetic face)")
+    parser.add_argument("--synthetic", action="store_true", help="generate the gallery instead of loading it")
+    parser.add_argument("--count", type=int, default=50, help="gallery size (loaded galleries are cycled)")
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    parser.add_argument("--face-density", type=float, default=0.7, help="fraction of synthetic images with faces")
+    parser.add_argument("--faces-per-image", type=int, default=2)
+    parser.add_argument("--faces-dir", default=os.path.join(HERE, "uploads"), help="photos to crop synthetic faces from")
+    parser.add_argument("--requests", type=int, default=3, help="endpoint mode: number of requests")
+    parser.add_argument("--warm", action="store_true", help="endpoint mode: keep the embedding cache between requests")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        gallery, target = synthetic_gallery(
+            args.count, args.width, args.height, args.face_density, args.faces_per_image, args.faces_dir, args.seed
+        )
+    elif args.source:
+        gallery, target = load_gallery(args.source, args.count), None
+    else:
+        parser.error("pass --synthetic or --source DIR")
+    if args.target:
+        with open(args.target, "rb") as f:
+            target = f.read()
+    target = target or gallery[0][1]
+
+    sys.path.insert(0, HERE)
+    import main
+
+    # The server's log prints go to stderr so stdout stays machine-readable
+    with tempfile.TemporaryDirectory(prefix="findme-bench-") as storage_dir, contextlib.redirect_stdout(sys.stderr):
+        install_stand_ins(main, storage_dir)
+        if args.mode == "stages":
+            report = run_stages(main, gallery, target)
+        else:
+            report = run_endpoint(main, gallery, target, args.requests, args.warm)
+        # Read the pool's peak RSS before shutting it down
+        rss = peak_rss_mb(main.encoding_engine.worker_pids())
+        main.image_store.shutdown()
+        main.encoding_engine.shutdown()
+
+    report = {
+        "mode": args.mode,
+        "images": len(gallery),
+        "gallery_mb": round(sum(len(c) for _, c in gallery) / 2**20, 2),
+        "config": {
+            "synthetic": args.synthetic,
+            "width": args.width if args.synthetic else None,
+            "height": args.height if args.synthetic else None,
+            "face_density": args.face_density if args.synthetic else None,
+            "detection": main.detection_config.cache_tag(),
+            "encoder_processes": main.encoding_engine.processes,
+        },
+        **report,
+        "peak_rss_mb": rss,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,377 @@
+import asyncio
+import io
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, List, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps, features
+
+# Face detection/encoding engine.
+# Kept free of FastAPI / Mongo / GCS imports so pool worker processes only load
+# PIL, numpy and the dlib models.
+
+@dataclass(frozen=True)
+class DetectionConfig:
+    """
+    Detection/encoding trade-offs (recall vs throughput).
+    detection_max_dim: longest side of the image HOG/CNN detection runs on (0 = full size)
+    encoding_max_dim: longest side of the image faces are encoded from (0 = full size)
+    upsample: number_of_times_to_upsample for face_locations (finds smaller faces, slower)
+    model: "hog" (CPU) or "cnn" (needs dlib CUDA to be practical)
+    """
+    detection_max_dim: int = 800
+    encoding_max_dim: int = 1600
+    upsample: int = 1
+    model: str = "hog"
+
+    def cache_tag(self) -> str:
+        """Identifies results produced with these settings (part of the embedding cache key)."""
+        return f"{self.model}-u{self.upsample}-d{self.detection_max_dim}-e{self.encoding_max_dim}"
+
+@dataclass(frozen=True)
+class DerivativeConfig:
+    """
+    Compact images rendered from the decoded image while it is in memory anyway.
+    thumbnail_max_dim: longest side of the thumbnail
+    face_crop_size: longest side of each face crop
+    format: "webp" or "jpeg" (see derivative_format)
+    """
+    thumbnail_max_dim: int = 320
+    face_crop_size: int = 160
+    format: str = "webp"
+    quality: int = 75
+
+    @property
+    def extension(self) -> str:
+        return ".webp" if self.format == "webp" else ".jpg"
+
+    def cache_tag(self) -> str:
+        """Identifies renders produced with these settings (see DetectionConfig.cache_tag)."""
+        return f"t{self.thumbnail_max_dim}-c{self.face_crop_size}-{self.format}-q{self.quality}"
+
+def derivative_format(preferred: str) -> str:
+    """preferred ("webp" | "jpeg"), or "jpeg" when this Pillow build has no WebP support."""
+    return "webp" if preferred == "webp" and features.check("webp") else "jpeg"
+
+def _load_image(file_content: bytes, max_dim: int = 0) -> Image.Image:
+    """
+    Decode to an upright RGB image whose longest side is at most max_dim.
+    For JPEGs, draft() lets libjpeg decode at the smallest 1/2, 1/4 or 1/8 scale that
+    still covers max_dim, so e.g. a 12 MP photo is decoded at 3 MP for max_dim=1600.
+    """
+    image = Image.open(io.BytesIO(file_content))
+    if max_dim and max(image.size) > max_dim:
+        # draft() only reduces while both sides stay at least the requested size, so ask
+        # for the aspect-preserving target rather than a max_dim square
+        scale = max_dim / max(image.size)
+        image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if max_dim and max(image.size) > max_dim:
+        image.thumbnail((max_dim, max_dim), Image.BILINEAR)
+    return image
+
+def _scale_box(box: Tuple[int, int, int, int], scale: float, width: int, height: int) -> Tuple[int, int, int, int]:
+    top, right, bottom, left = box
+    return (
+        max(0, int(round(top * scale))),
+        min(width, int(round(right * scale))),
+        min(height, int(round(bottom * scale))),
+        max(0, int(round(left * scale))),
+    )
+
+def _encode_derivative(image: Image.Image, config: DerivativeConfig) -> bytes:
+    buffer = io.BytesIO()
+    if config.format == "webp":
+        image.save(buffer, "WEBP", quality=config.quality, method=4)
+    else:
+        image.save(buffer, "JPEG", quality=config.quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+def _fit(image: Image.Image, max_dim: int) -> Image.Image:
+    if max(image.size) <= max_dim:
+        return image
+    scale = max_dim / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+def render_derivatives(
+    image: Image.Image, locations: List[Tuple[int, int, int, int]], config: DerivativeConfig
+) -> List[Tuple[str, bytes]]:
+    """
+    Face crops ("face0", "face1", ... in locations order) followed by the thumbnail
+    ("thumb"), encoded as config.format. The thumbnail comes last so that once it is
+    stored, the whole set is.
+    """
+    rendered = []
+    for i, (top, right, bottom, left) in enumerate(locations):
+        # Pad the detector box so the crop shows the whole head
+        pad_x, pad_y = (right - left) // 4, (bottom - top) // 4
+        crop = image.crop((
+            max(0, left - pad_x), max(0, top - pad_y),
+            min(image.width, right + pad_x), min(image.height, bottom + pad_y),
+        ))
+        rendered.append((f"face{i}", _encode_derivative(_fit(crop, config.face_crop_size), config)))
+    rendered.append(("thumb", _encode_derivative(_fit(image, config.thumbnail_max_dim), config)))
+    return rendered
+
+def render_derivatives_from_bytes(
+    file_content: bytes,
+    locations: List[Tuple[int, int, int, int]],
+    image_size: Tuple[int, int],
+    config: DerivativeConfig,
+) -> List[Tuple[str, bytes]]:
+    """render_derivatives for an image whose face data came from the embedding cache (no detection)."""
+    image = _load_image(file_content, max(image_size) if image_size else 0)
+    if image_size and tuple(image.size) != tuple(image_size):
+        scale = image.width / image_size[0]
+        locations = [_scale_box(loc, scale, image.width, image.height) for loc in locations]
+    return render_derivatives(image, locations, config)
+
+def detect_and_encode(
+    file_content: bytes,
+    config: DetectionConfig = DetectionConfig(),
+    timings: Optional[Dict[str, float]] = None,
+    derivatives: Optional[DerivativeConfig] = None,
+) -> Dict:
+    """
+    Run face detection + encoding on one image.
+    Detection runs on a copy bounded by config.detection_max_dim; the boxes are mapped
+    back to the (larger) encoding image. Images without faces skip the encoding pass.
+    Returns {"locations": [(top, right, bottom, left), ...], "encodings": [np.ndarray(128), ...],
+    "image_size": (width, height)} with locations in the encoding image's coordinates.
+    If a timings dict is passed, per-stage seconds are added under "decode", "detect", "encode".
+    With a DerivativeConfig, render_derivatives output is added under "derivatives".
+    """
+    import face_recognition
+
+    started = time.perf_counter()
+    encode_image = _load_image(file_content, config.encoding_max_dim)
+    width, height = encode_image.size
+
+    detect_image, scale = encode_image, 1.0
+    if config.detection_max_dim and max(width, height) > config.detection_max_dim:
+        scale = max(width, height) / config.detection_max_dim
+        detect_image = encode_image.resize(
+            (max(1, round(width / scale)), max(1, round(height / scale))), Image.BILINEAR
+        )
+    decoded = time.perf_counter()
+
+    locations = face_recognition.face_locations(
+        np.asarray(detect_image), number_of_times_to_upsample=config.upsample, model=config.model
+    )
+    detected = time.perf_counter()
+    if timings is not None:
+        timings["decode"] = timings.get("decode", 0.0) + (decoded - started)
+        timings["detect"] = timings.get("detect", 0.0) + (detected - decoded)
+    if not locations:
+        face_data = {"locations": [], "encodings": [], "image_size": (width, height)}
+    else:
+        locations = [_scale_box(loc, scale, width, height) for loc in locations]
+        encodings = face_recognition.face_encodings(np.asarray(encode_image), known_face_locations=locations)
+        if timings is not None:
+            timings["encode"] = timings.get("encode", 0.0) + (time.perf_counter() - detected)
+        face_data = {"locations": locations, "encodings": list(encodings), "image_size": (width, height)}
+
+    if derivatives is not None:
+        rendering = time.perf_counter()
+        face_data["derivatives"] = render_derivatives(encode_image, face_data["locations"], derivatives)
+        if timings is not None:
+            timings["derivatives"] = timings.get("derivatives", 0.0) + (time.perf_counter() - rendering)
+    return face_data
+
+def _safe_detect_and_encode(
+    file_content: bytes, config: DetectionConfig, derivatives: Optional[DerivativeConfig] = None
+) -> Dict:
+    """detect_and_encode that never raises; stage timings travel back under "timings"."""
+    timings: Dict[str, float] = {}
+    try:
+        face_data = detect_and_encode(file_content, config, timings, derivatives)
+    except Exception as e:
+        face_data = {"error": str(e)}
+    face_data["timings"] = timings
+    return face_data
+
+# POOL WORKER SIDE
+
+def _init_worker():
+    # Importing face_recognition loads the dlib detector / landmark / encoder models;
+    # do it once per worker process instead of on the first image.
+    import face_recognition  # noqa: F401
+
+def _ping() -> int:
+    return os.getpid()
+
+# ENGINE
+
+def default_processes(web_workers: int = 1) -> int:
+    """Pool size that gives each of web_workers processes (gunicorn workers) an equal share of the cores."""
+    return max(1, (os.cpu_count() or 1) // max(1, web_workers))
+
+def _default_start_method() -> str:
+    # forkserver: the models are imported once in the fork server and every pool process
+    # forked from it shares those pages copy-on-write (spawn would load them N times)
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+class EncodingEngine:
+    """
+    Process pool that fans gallery images out across all cores.
+
+    Every image is one pool task; at most `max_in_flight` are queued on the pool at any
+    time (shared by every request in this process), so concurrent requests interleave
+    instead of one large gallery monopolising the pool.
+    With processes=0 everything runs inline on a thread.
+    `warm` is set once the models are loaded (see start()). If a pool process dies (e.g.
+    OOM-killed) the pool is replaced and the image retried once; on_state receives
+    "restarting" and then "warm" (or "failed") while that happens.
+    """
+
+    def __init__(
+        self,
+        processes: Optional[int] = None,
+        max_in_flight: Optional[int] = None,
+        config: Optional[DetectionConfig] = None,
+        observer: Optional[Callable[[Dict[str, float]], None]] = None,
+        start_method: Optional[str] = None,
+        derivatives: Optional[DerivativeConfig] = None,
+        on_state: Optional[Callable[[str], None]] = None,
+    ):
+        if processes is None:
+            processes = default_processes()
+        self.processes = max(0, processes)
+        self.max_in_flight = max_in_flight or max(1, self.processes * 2)
+        self.config = config or DetectionConfig()
+        self.observer = observer # receives each image's {"decode", "detect", "encode"} seconds
+        self.start_method = start_method or _default_start_method()
+        self.derivatives = derivatives # render thumbnails / face crops alongside encoding
+        self.on_state = on_state
+        self.warm = threading.Event()
+        self._async_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Create the pool and load the models in every worker process. Blocking; sets `warm`."""
+        if self.processes == 0:
+            _init_worker()
+            self.warm.set()
+            return
+        with self._lock:
+            if self._executor is not None:
+                return
+            executor = self._executor = self._new_executor()
+        self._warm_up(executor)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == "forkserver":
+            context.set_forkserver_preload(["face_engine", "face_recognition"])
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=context, initializer=_init_worker)
+
+    def _warm_up(self, executor: ProcessPoolExecutor) -> None:
+        # Force every worker to start (and run _init_worker) now rather than on the first request
+        for f in [executor.submit(_ping) for _ in range(self.processes)]:
+            f.result()
+        self.warm.set()
+
+    def restart(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Replace a pool that a dead worker process left broken (every submit would raise
+        BrokenProcessPool). Blocking. No-op if another caller already replaced it.
+        """
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self.warm.clear()
+            self._notify("restarting")
+            broken.shutdown(wait=False, cancel_futures=True)
+            executor = self._executor = self._new_executor()
+        try:
+            self._warm_up(executor)
+        except Exception:
+            self._notify("failed")
+            raise
+        self._notify("warm")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        self.warm.clear()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def worker_pids(self) -> List[int]:
+        """Process ids of the current pool's worker processes (empty when inline or not started)."""
+        executor = self._executor
+        return list(executor._processes or {}) if executor is not None else []
+
+    def _notify(self, state: str) -> None:
+        if self.on_state is not None:
+            self.on_state(state)
+
+    async def encode_async(self, contents: List[bytes], derivatives: bool = True) -> List[Dict]:
+        """
+        Detect + encode every image. Pool tasks are awaited as asyncio futures, so waiting
+        for a pool slot or a result holds no thread. derivatives=False skips rendering
+        thumbnails / face crops (e.g. for query images).
+        Returns one face_data dict per input, in order; failures are {"error": str}, plus
+        "transient": True when the pool failed rather than the image.
+        """
+        if not contents:
+            return []
+        loop = asyncio.get_running_loop()
+        rendering = self.derivatives if derivatives else None
+        if self.processes == 0:
+            return self._observe(await loop.run_in_executor(
+                None, lambda: [_safe_detect_and_encode(content, self.config, rendering) for content in contents]
+            ))
+        if self._executor is None:
+            await loop.run_in_executor(None, self.start)
+        slots = self._async_semaphore(loop)
+
+        async def run(content: bytes) -> Dict:
+            async with slots:
+                executor = self._executor
+                for attempt in range(2):
+                    try:
+                        return await asyncio.wrap_future(
+                            executor.submit(_safe_detect_and_encode, content, self.config, rendering)
+                        )
+                    except BrokenProcessPool as e:
+                        # A worker died (e.g. OOM-killed) and took the pool with it: replace it, retry once
+                        error = e
+                        if attempt:
+                            break
+                        try:
+                            await loop.run_in_executor(None, self.restart, executor)
+                        except Exception as restart_error:
+                            error = restart_error
+                            break
+                        executor = self._executor
+                    except Exception as e:
+                        error = e
+                        break
+                return {"error": str(error), "transient": True}
+
+        return self._observe(list(await asyncio.gather(*(run(content) for content in contents))))
+
+    def _async_semaphore(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        # asyncio primitives belong to one event loop; make a new gate if the loop changed
+        if self._async_slots is None or self._async_slots[0] is not loop:
+            self._async_slots = (loop, asyncio.Semaphore(self.max_in_flight))
+        return self._async_slots[1]
+
+    def _observe(self, results: List[Dict]) -> List[Dict]:
+        for face_data in results:
+            timings = face_data.pop("timings", None)
+            if timings and self.observer is not None:
+                self.observer(timings)
+        return results
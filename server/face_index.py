@@ -0,0 +1,149 @@
+import threading
+from typing import List, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+# Approximate nearest-neighbour index over 128-d face encodings (pure NumPy).
+# Small indexes are searched brute force. Once an index reaches `train_threshold`
+# faces it is partitioned with k-means (IVF): every face is assigned to its nearest
+# centroid and a query only scans the faces in the `n_probe` closest partitions.
+# New faces are inserted incrementally into their nearest partition; the centroids
+# are retrained when the index has grown by `retrain_factor` since the last training.
+
+def _squared_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(len(a), len(b)) squared euclidean distances."""
+    sq = (
+        np.einsum("ij,ij->i", a, a)[:, None]
+        + np.einsum("ij,ij->i", b, b)[None, :]
+        - 2.0 * a @ b.T
+    )
+    return np.maximum(sq, 0.0)
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _squared_distances(data, centroids).argmin(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return centroids
+
+class FaceIndex:
+    """
+    Thread-safe, append-only face index. Each face vector points at a payload
+    (e.g. an image URL); search results are aggregated to the best distance per payload.
+    """
+
+    def __init__(
+        self,
+        dim: int = 128,
+        n_probe: int = 8,
+        train_threshold: int = 20000,
+        retrain_factor: float = 2.0,
+        seed: int = 0,
+    ):
+        self.dim = dim
+        self.n_probe = n_probe
+        self.train_threshold = train_threshold
+        self.retrain_factor = retrain_factor
+        self._vectors = np.empty((1024, dim), dtype=np.float32)
+        self._owner = np.empty(1024, dtype=np.int64) # vector row -> payload id
+        self._assign = np.empty(1024, dtype=np.int32) # vector row -> partition
+        self._size = 0
+        self._payloads: List[Hashable] = []
+        self._payload_ids: Dict[Hashable, int] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._trained_size = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def n_payloads(self) -> int:
+        return len(self._payloads)
+
+    def __contains__(self, payload: Hashable) -> bool:
+        return payload in self._payload_ids
+
+    def add(self, payload: Hashable, encodings: List[np.ndarray]) -> None:
+        """Insert the faces of one image. Payloads already in the index are ignored."""
+        if not encodings:
+            return
+        vectors = np.ascontiguousarray(np.vstack(encodings), dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if payload in self._payload_ids:
+                return
+            payload_id = len(self._payloads)
+            self._payloads.append(payload)
+            self._payload_ids[payload] = payload_id
+
+            self._reserve(self._size + len(vectors))
+            rows = slice(self._size, self._size + len(vectors))
+            self._vectors[rows] = vectors
+            self._owner[rows] = payload_id
+            if self._centroids is not None:
+                self._assign[rows] = _squared_distances(vectors, self._centroids).argmin(axis=1)
+            self._size += len(vectors)
+
+            if self._size >= self.train_threshold and (
+                self._centroids is None or self._size >= self._trained_size * self.retrain_factor
+            ):
+                self._train()
+
+    def _reserve(self, capacity: int) -> None:
+        if capacity <= len(self._vectors):
+            return
+        new_capacity = max(capacity, 2 * len(self._vectors))
+        for name in ("_vectors", "_owner", "_assign"):
+            old = getattr(self, name)
+            grown = np.empty((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, name, grown)
+
+    def _train(self, iterations: int = 10, sample_size: int = 50000) -> None:
+        data = self._vectors[:self._size]
+        n_lists = max(1, int(np.sqrt(self._size)))
+        sample = data if self._size <= sample_size else data[self._rng.choice(self._size, sample_size, replace=False)]
+        self._centroids = _kmeans(sample, min(n_lists, len(sample)), iterations, self._rng)
+        # Assign in blocks to bound the temporary distance matrix
+        for start in range(0, self._size, 8192):
+            block = data[start:start + 8192]
+            self._assign[start:start + len(block)] = _squared_distances(block, self._centroids).argmin(axis=1)
+        self._trained_size = self._size
+
+    def search(self, queries: List[np.ndarray], max_distance: float, limit: int = 100) -> List[Tuple[Hashable, float]]:
+        """
+        Payloads with any face within max_distance of any query face,
+        as (payload, best_distance) sorted closest first.
+        """
+        if not queries:
+            return []
+        q = np.ascontiguousarray(np.vstack(queries), dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if self._size == 0:
+                return []
+            if self._centroids is None:
+                rows = np.arange(self._size)
+            else:
+                n_probe = min(self.n_probe, len(self._centroids))
+                probe = np.argpartition(_squared_distances(q, self._centroids), n_probe - 1, axis=1)[:, :n_probe]
+                rows = np.flatnonzero(np.isin(self._assign[:self._size], probe))
+            candidates = self._vectors[rows]
+            owners = self._owner[rows]
+
+        if len(rows) == 0:
+            return []
+        distances = np.sqrt(_squared_distances(candidates, q).min(axis=1))
+        hit = distances <= max_distance
+        if not hit.any():
+            return []
+
+        best = np.full(len(self._payloads), np.inf, dtype=np.float32)
+        np.minimum.at(best, owners[hit], distances[hit])
+        found = np.flatnonzero(np.isfinite(best))
+        found = found[np.argsort(best[found], kind="stable")][:limit]
+        return [(self._payloads[i], float(best[i])) for i in found]
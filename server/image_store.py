@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Content-addressed image storage.
+# Files are stored under <user_id>/<sha256><ext>, so uploading the same bytes twice
+# writes once and returns the same URL. Writes run on a bounded thread pool so the
+# request/CPU path only waits for them when it needs the URL.
+# Derivatives (thumbnails, face crops) sit next to their original as
+# <user_id>/<sha256>.<tag>.<name><ext>, where tag identifies the settings they were
+# rendered with. Since a path never changes content, everything is served as immutable
+# (see IMMUTABLE_CACHE_CONTROL).
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+mimetypes.add_type("image/webp", ".webp")
+
+class LocalStorageBackend:
+    """Writes into a local directory served by FastAPI at <base_url>/uploads/..."""
+
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(root, exist_ok=True)
+
+    def url_for(self, path: str) -> str:
+        return f"{self.base_url}/uploads/{path}"
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(os.path.join(self.root, *path.split("/")))
+
+    def put_if_absent(self, path: str, data: bytes, content_type: str) -> bool:
+        """Write data at path unless it already exists. Returns True if written."""
+        file_path = os.path.join(self.root, *path.split("/"))
+        if os.path.exists(file_path):
+            return False
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+class GCSStorageBackend:
+    """
+    Google Cloud Storage bucket. The client (credential discovery, HTTP session) is created
+    on first use rather than at import, then reused; a failed init is remembered so
+    ImageStore falls back to local storage without retrying it on every write.
+    """
+
+    def __init__(self, bucket_name: str, prefix: str = "user_images", client=None):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self._client = client
+        self._bucket = None
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """The bucket object; creates the client if needed. Raises if the client cannot be created."""
+        if self._bucket is None:
+            with self._lock:
+                if self._error is not None:
+                    raise self._error
+                if self._bucket is None:
+                    try:
+                        client = self._client
+                        if client is None:
+                            from google.cloud import storage
+                            client = storage.Client()
+                        self._bucket = client.bucket(self.bucket_name)
+                    except Exception as e:
+                        print(f"Warning: Google Cloud Storage client init failed: {e}. Falling back to local storage.")
+                        self._error = e
+                        raise
+        return self._bucket
+
+    @property
+    def bucket(self):
+        return self.connect()
+
+    def url_for(self, path: str) -> str:
+        return self.bucket.blob(f"{self.prefix}/{path}").public_url
+
+    def exists(self, path: str) -> bool:
+        return self.bucket.blob(f"{self.prefix}/{path}").exists()
+
+    def put_if_absent(self, path: str, data: bytes, content_type: str) -> bool:
+        from google.api_core.exceptions import PreconditionFailed
+
+        blob = self.bucket.blob(f"{self.prefix}/{path}")
+        blob.cache_control = IMMUTABLE_CACHE_CONTROL
+        try:
+            # if_generation_match=0: only create, never overwrite (one round trip, no exists() check)
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+        except PreconditionFailed:
+            return False
+        return True
+
+def _extension(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext and len(ext) <= 5 and ext[1:].isalnum() else ".jpg"
+
+class ImageStore:
+    """Content-addressed, deduplicated, concurrent image writes on top of a storage backend."""
+
+    def __init__(
+        self,
+        backend,
+        fallback=None,
+        max_workers: int = 8,
+        observer: Optional[Callable[[float, bool], None]] = None,
+        stored_cache_size: int = 10000,
+    ):
+        self.backend = backend
+        self.fallback = fallback
+        self.observer = observer # receives (seconds, written) for every store() call
+        self.stored_cache_size = stored_cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-store")
+        # Recently written paths known to exist in the primary backend, to skip even the
+        # existence check (LRU-bounded; a forgotten path costs one put_if_absent round trip)
+        self._stored: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _is_stored(self, path: str) -> bool:
+        with self._lock:
+            if path not in self._stored:
+                return False
+            self._stored.move_to_end(path)
+            return True
+
+    def _mark_stored(self, path: str) -> None:
+        with self._lock:
+            self._stored[path] = None
+            self._stored.move_to_end(path)
+            while len(self._stored) > self.stored_cache_size:
+                self._stored.popitem(last=False)
+
+    def path_for(self, file_content: bytes, filename: Optional[str], user_id: str, digest: Optional[str] = None) -> str:
+        digest = digest or hashlib.sha256(file_content).hexdigest()
+        return f"{user_id}/{digest}{_extension(filename)}"
+
+    def derivative_path(self, user_id: str, digest: str, tag: str, name: str, extension: str) -> str:
+        return f"{user_id}/{digest}.{tag}.{name}{extension}"
+
+    def store(self, file_content: bytes, filename: Optional[str], user_id: str, digest: Optional[str] = None) -> str:
+        """Blocking write; returns the public URL. Identical bytes are written only once."""
+        return self.put(self.path_for(file_content, filename, user_id, digest), file_content, filename)
+
+    async def store_derivatives_async(
+        self, rendered: List[Tuple[str, bytes]], user_id: str, digest: str, tag: str, extension: str
+    ) -> Dict[str, str]:
+        """
+        Write [(name, bytes)] renders of the original `digest`, made with the settings
+        identified by `tag`, on the storage pool; returns
+        {name: url}. All but the last are written concurrently, the last once they are
+        stored, so a stored last render means the whole set is (see locate).
+        """
+        def submit(name: str, data: bytes) -> "asyncio.Future[str]":
+            path = self.derivative_path(user_id, digest, tag, name, extension)
+            return asyncio.wrap_future(self._executor.submit(self.put, path, data))
+
+        *first, (last_name, last_data) = rendered
+        urls = dict(zip([name for name, _ in first], await asyncio.gather(*(submit(name, data) for name, data in first))))
+        urls[last_name] = await submit(last_name, last_data)
+        return urls
+
+    def locate(self, paths: List[str]) -> Optional[List[str]]:
+        """
+        URLs of a set of paths whose last one is written after the others (e.g. by
+        store_derivatives_async) if the set is already stored in the primary or fallback
+        backend, else None. Only the last path is checked.
+        """
+        last = paths[-1]
+        for backend in (self.backend, self.fallback):
+            if backend is None:
+                continue
+            try:
+                if (backend is self.backend and self._is_stored(last)) or backend.exists(last):
+                    return [backend.url_for(path) for path in paths]
+            except Exception:
+                continue
+        return None
+
+    def put(self, path: str, file_content: bytes, filename: Optional[str] = None) -> str:
+        """Blocking write of file_content at path unless already stored; returns the public URL."""
+        filename = filename or path
+        started = time.perf_counter()
+        backend = self.backend
+        written = False
+        if not self._is_stored(path):
+            content_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+            try:
+                written = backend.put_if_absent(path, file_content, content_type)
+            except Exception as e:
+                if self.fallback is None:
+                    raise
+                print(f"CRITICAL: Failed to upload {filename} to primary storage. Error: {e}")
+                backend = self.fallback
+                written = backend.put_if_absent(path, file_content, content_type)
+            else:
+                self._mark_stored(path)
+        if self.observer is not None:
+            self.observer(time.perf_counter() - started, written)
+        return backend.url_for(path)
+
+    async def locate_async(self, paths: List[str]) -> Optional[List[str]]:
+        return await asyncio.wrap_future(self._executor.submit(self.locate, paths))
+
+    def submit(self, file_content: bytes, filename: Optional[str], user_id: str, digest: Optional[str] = None) -> Future:
+        """Queue a write on the storage pool; the future resolves to the URL."""
+        return self._executor.submit(self.store, file_content, filename, user_id, digest)
+
+    async def store_async(self, file_content: bytes, filename: Optional[str], user_id: str, digest: Optional[str] = None) -> str:
+        return await asyncio.wrap_future(self.submit(file_content, filename, user_id, digest))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
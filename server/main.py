@@ -1,24 +1,43 @@
-import io
+import asyncio
+import base64
+import hashlib
+import json
 import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Optional
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Optional, Tuple
 
 import bcrypt
-import face_recognition
 import numpy as np
 from bson import ObjectId
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile, status
+from fastapi import Depends, FastAPI, File, HTTPException, Query, Request, UploadFile, status
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from google.cloud import storage
 from jose import JWTError, jwt
 from motor.motor_asyncio import AsyncIOMotorClient
-from PIL import Image, ImageOps
+from pymongo import UpdateOne
 from pydantic import BaseModel, Field, EmailStr
 from pydantic_settings import BaseSettings
 
+import metrics
+from face_engine import (
+    DerivativeConfig,
+    DetectionConfig,
+    EncodingEngine,
+    default_processes,
+    derivative_format,
+    render_derivatives_from_bytes,
+)
+from face_index import FaceIndex
+from image_store import IMMUTABLE_CACHE_CONTROL, GCSStorageBackend, ImageStore, LocalStorageBackend
+
 class Settings(BaseSettings):
     MONGO_URI: str
     GCS_BUCKET_NAME: Optional[str] = None
@@ -26,6 +45,38 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
     APP_BASE_URL: str = "http://localhost:8000"
+    MATCH_TOLERANCE: float = 0.6 # face distance threshold; lower is stricter
+    ENCODER_PROCESSES: Optional[int] = None # face encoding pool size; None = CPU count / WEB_CONCURRENCY, 0 = inline
+    WEB_CONCURRENCY: int = 1 # web worker processes on this machine (gunicorn reads the same variable for -w)
+    INGEST_MAX_IN_FLIGHT: int = 8 # gallery files held in memory at once per request
+    JOB_WORKERS: int = 1 # background search jobs run concurrently per process
+    JOB_QUEUE_SIZE: int = 100 # pending jobs per process before submissions get 503
+    JOB_SPOOL_MAX_BYTES: int = 256 * 1024 * 1024 # upload bytes held for queued/running jobs per process before submissions get 503
+    JOB_PROGRESS_INTERVAL: float = 1.0 # seconds between job progress writes
+    JOB_HEARTBEAT_INTERVAL: float = 30.0 # seconds between updated_at refreshes of a process's queued/running jobs
+    JOB_STALE_AFTER: float = 300.0 # queued/running jobs not refreshed for this long are reported as failed
+    STORAGE_MAX_WORKERS: int = 8 # concurrent storage uploads per process
+    DERIVATIVES_ENABLED: bool = True # store a thumbnail and face crops for every gallery image
+    THUMBNAIL_MAX_DIM: int = 320 # longest side of gallery thumbnails
+    FACE_CROP_SIZE: int = 160 # longest side of face crops
+    DERIVATIVE_FORMAT: str = "webp" # "webp" or "jpeg" (jpeg is used if Pillow lacks WebP)
+    DERIVATIVE_QUALITY: int = 75 # WebP/JPEG quality of thumbnails and face crops
+    FACE_INDEX_MAX_FACES: int = 200000 # faces of all users' search indexes kept in memory per process (~0.5 KB each)
+    FACE_INDEX_N_PROBE: int = 8 # partitions scanned per query once an index is partitioned
+    FACE_INDEX_TRAIN_THRESHOLD: int = 20000 # faces before an index switches from brute force to partitions
+    FACE_INDEX_CATCH_UP_OVERLAP: float = 300.0 # seconds before an index's watermark re-read on catch-up
+    DETECTION_MAX_DIM: int = 800 # longest side used for face detection; 0 = full resolution
+    ENCODING_MAX_DIM: int = 1600 # longest side used for face encoding; 0 = full resolution
+    DETECTION_UPSAMPLE: int = 1 # face_locations upsample passes; higher finds smaller faces, slower
+    DETECTION_MODEL: str = "hog" # "hog" or "cnn"
+    WARM_UP_MODELS: bool = True # load face models in the background at startup; False = on first use
+    READY_PING_TIMEOUT: float = 2.0 # seconds a readiness ping of MongoDB may take
+    READY_RECHECK_INTERVAL: float = 5.0 # seconds between MongoDB pings from /ready while it is not "ok"
+    MAX_TARGET_IMAGES: int = 10 # target images per search (target_image + target_images)
+    USER_CACHE_TTL: float = 30.0 # seconds an authenticated user lookup is reused per process; 0 disables
+    USER_CACHE_SIZE: int = 1024 # users kept in the per-process auth cache
+    PROFILING_ENABLED: bool = False # allow ?profile=1 / "X-Profile: 1" to sample a request's stacks
+    PROFILE_SAMPLE_INTERVAL: float = 0.005 # seconds between stack samples while profiling
 
     class Config:
         env_file = ".env" # Loads from a .env file for local development
@@ -43,27 +94,103 @@ origins = [
 ]
 app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
+def _route_label(scope: Dict) -> str:
+    """Route template (/jobs/{job_id}), not the raw path, to bound metric label cardinality."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mounts (the /uploads static files) set no route, only the root_path they matched
+    if "app_root_path" in scope:
+        return scope.get("root_path", "")[len(scope["app_root_path"]):] or "unmatched"
+    return "unmatched"
+
+# Request latency and opt-in per-request profiling (see metrics.py)
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    sampler = None
+    if settings.PROFILING_ENABLED and "1" in (request.query_params.get("profile"), request.headers.get("x-profile")):
+        sampler = metrics.StackSampler(settings.PROFILE_SAMPLE_INTERVAL).start()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=_route_label(request.scope),
+            status=status_code,
+        )
+        folded = sampler.stop() if sampler is not None else None
+    if folded is not None:
+        profile_id = uuid.uuid4().hex
+        metrics.PROFILES.add(profile_id, folded)
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
 # Password Hashing & JWT) 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 # Database Connection 
-client = AsyncIOMotorClient(settings.MONGO_URI)
+# connect=False: no monitor threads or sockets until the first query, so importing this
+# module is cheap and safe to do in the gunicorn master before forking (--preload)
+client = AsyncIOMotorClient(settings.MONGO_URI, connect=False)
 db = client.find_me_db
 user_collection = db.users
 results_collection = db.results
+embeddings_collection = db.face_embeddings
+jobs_collection = db.jobs
+user_images_collection = db.user_images
 
-# Google Cloud Storage Client 
-# currently not in use / not working / service unavailable
-storage_client = None
-if settings.GCS_BUCKET_NAME:
-    try:
-        storage_client = storage.Client()
-    except Exception as e:
-        print(f"Warning: Google Cloud Storage client init failed: {e}. Falling back to local storage.")
+# Face encoding process pool (models are loaded once per pool, in the background at startup).
+# Every web worker owns a pool, so by default they split the cores between them.
+detection_config = DetectionConfig(
+    detection_max_dim=settings.DETECTION_MAX_DIM,
+    encoding_max_dim=settings.ENCODING_MAX_DIM,
+    upsample=settings.DETECTION_UPSAMPLE,
+    model=settings.DETECTION_MODEL,
+)
+derivative_config = DerivativeConfig(
+    thumbnail_max_dim=settings.THUMBNAIL_MAX_DIM,
+    face_crop_size=settings.FACE_CROP_SIZE,
+    format=derivative_format(settings.DERIVATIVE_FORMAT),
+    quality=settings.DERIVATIVE_QUALITY,
+)
+encoding_engine = EncodingEngine(
+    processes=settings.ENCODER_PROCESSES if settings.ENCODER_PROCESSES is not None else default_processes(settings.WEB_CONCURRENCY),
+    config=detection_config,
+    observer=metrics.observe_stages,
+    derivatives=derivative_config if settings.DERIVATIVES_ENABLED else None,
+    on_state=lambda state: readiness.update(models=state), # a crashed pool being replaced
+)
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    Stored files are content-addressed (a path never changes content), so browsers may
+    cache them for good. StaticFiles already sends ETag/Last-Modified and answers
+    If-None-Match with 304.
+    """
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", ImmutableStaticFiles(directory=UPLOAD_DIR), name="uploads")
+
+# Image storage: GCS when configured (local uploads as fallback), otherwise local only.
+# The GCS client is created lazily (see GCSStorageBackend.connect).
+local_storage = LocalStorageBackend(UPLOAD_DIR, settings.APP_BASE_URL)
+image_store = ImageStore(
+    GCSStorageBackend(settings.GCS_BUCKET_NAME) if settings.GCS_BUCKET_NAME else local_storage,
+    fallback=local_storage if settings.GCS_BUCKET_NAME else None,
+    max_workers=settings.STORAGE_MAX_WORKERS,
+    observer=metrics.observe_storage,
+)
 
 # PYDANTIC MODELS
 class PyObjectId(ObjectId):
@@ -86,6 +213,10 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
 
+class UserUpdate(BaseModel):
+    username: Optional[str] = None
+    address: Optional[str] = None
+
 class UserInDB(UserBase):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     hashed_password: str
@@ -110,12 +241,36 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
-async def get_user(email: str) -> Optional[UserInDB]:
-    user = await user_collection.find_one({"email": email})
+async def get_user(email: str, projection: Optional[Dict] = None) -> Optional[UserInDB]:
+    with metrics.stage_timer("mongo_read"):
+        user = await user_collection.find_one({"email": email}, projection)
     if user:
         return UserInDB(**user)
     return None
 
+# Per-process cache of authenticated users (email -> (expires_at, user)), LRU-bounded.
+# Entries are dropped on profile changes in this process; other processes see them
+# within USER_CACHE_TTL.
+user_cache: "OrderedDict[str, Tuple[float, UserInDB]]" = OrderedDict()
+
+async def get_cached_user(email: str) -> Optional[UserInDB]:
+    now = time.monotonic()
+    cached = user_cache.get(email)
+    if cached is not None and cached[0] > now:
+        user_cache.move_to_end(email)
+        return cached[1]
+    # saved_galleries grows with every search and is not needed to authorize a request
+    user = await get_user(email, {"saved_galleries": 0})
+    if user is not None and settings.USER_CACHE_TTL > 0:
+        user_cache[email] = (now + settings.USER_CACHE_TTL, user)
+        user_cache.move_to_end(email)
+        while len(user_cache) > settings.USER_CACHE_SIZE:
+            user_cache.popitem(last=False)
+    return user
+
+def invalidate_cached_user(email: str) -> None:
+    user_cache.pop(email, None)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire_delta = expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -138,122 +293,591 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = await get_user(email=token_data.email)
+    user = await get_cached_user(token_data.email)
     if user is None:
         raise credentials_exception
     return user
 
-def upload_to_gcs(file_content: bytes, filename: str, user_id: str) -> str:
+# CORE LOGIC (CPU-INTENSIVE)
+
+def content_hash(file_content: bytes) -> str:
+    """SHA-256 of the raw upload bytes; used as the key of the face-embedding index."""
+    return hashlib.sha256(file_content).hexdigest()
+
+def embedding_key(file_content: bytes, digest: Optional[str] = None) -> str:
+    """Embedding index key: content hash + detection settings, so changing them re-indexes."""
+    return f"{digest or content_hash(file_content)}:{detection_config.cache_tag()}"
+
+def derivative_tag() -> str:
+    """
+    Short id of the detection + derivative settings, part of every derivative's path:
+    stored renders are immutable, so changing a setting must give them new paths (and
+    face crop N must come from the same detection as face_crop_urls[N]).
+    """
+    tag = f"{detection_config.cache_tag()}:{derivative_config.cache_tag()}"
+    return hashlib.sha256(tag.encode()).hexdigest()[:12]
+
+def _render_derivatives(file_content: bytes, face_data: Dict) -> List[Tuple[str, bytes]]:
+    with metrics.stage_timer("derivatives"):
+        return render_derivatives_from_bytes(
+            file_content, face_data["locations"], face_data.get("image_size"), derivative_config
+        )
+
+async def save_derivatives(file_content: bytes, face_data: Dict, user_id: str, digest: Optional[str] = None) -> Dict:
+    """
+    Store the thumbnail and face crops of a processed image next to the original, on the
+    storage pool. Returns {"thumbnail_url": str, "face_crop_urls": [str per face, in
+    locations order]}. Renders made by the encoding worker are used when present
+    (face_data["derivatives"], removed here). Images whose face data came from the
+    embedding cache were usually stored before; otherwise they are rendered from the
+    original bytes.
+    """
+    digest = digest or content_hash(file_content)
+    tag, extension = derivative_tag(), derivative_config.extension
+    names = [f"face{i}" for i in range(len(face_data["locations"]))] + ["thumb"]
+    rendered = face_data.pop("derivatives", None)
+    if rendered is None:
+        stored = await image_store.locate_async([image_store.derivative_path(user_id, digest, tag, name, extension) for name in names])
+        if stored is not None:
+            return {"thumbnail_url": stored[-1], "face_crop_urls": stored[:-1]}
+        rendered = await run_in_threadpool(_render_derivatives, file_content, face_data)
+    urls = await image_store.store_derivatives_async(rendered, user_id, digest, tag, extension)
+    return {"thumbnail_url": urls["thumb"], "face_crop_urls": [urls[name] for name in names[:-1]]}
+
+def _add_derivative_urls(results: Dict, derivative_urls: Dict[str, Dict]) -> Dict:
+    """
+    Adds "thumbnails": [{"url", "thumbnail_url", "face_crop_urls"}] for the gallery images
+    (a list rather than a URL-keyed dict, since URLs are not valid Mongo field names).
+    """
+    if settings.DERIVATIVES_ENABLED:
+        results["thumbnails"] = [{"url": url, **urls} for url, urls in derivative_urls.items()]
+    return results
+
+def _face_distance_matrix(
+    target_encodings: List[np.ndarray],
+    gallery_encodings: List[List[np.ndarray]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    All gallery faces are stacked into one contiguous float32 matrix and compared to
+    every target encoding in a single distance computation.
+    Returns (distances (n_faces, n_targets), owning image per face row, faces per image).
+    """
+    n_images = len(gallery_encodings)
+    counts = np.fromiter((len(encs) for encs in gallery_encodings), dtype=np.intp, count=n_images)
+    owners = np.repeat(np.arange(n_images), counts)
+    if counts.sum() == 0 or not target_encodings:
+        return np.empty((len(owners), len(target_encodings)), dtype=np.float32), owners, counts
+    faces = np.ascontiguousarray(
+        np.vstack([enc for encs in gallery_encodings for enc in encs]), dtype=np.float32
+    )
+    targets = np.ascontiguousarray(np.vstack(target_encodings), dtype=np.float32)
+
+    with metrics.stage_timer("match"):
+        # ||f - t||^2 = ||f||^2 + ||t||^2 - 2 f.t  -> (n_faces, n_targets)
+        sq = (
+            np.einsum("ij,ij->i", faces, faces)[:, None]
+            + np.einsum("ij,ij->i", targets, targets)[None, :]
+            - 2.0 * faces @ targets.T
+        )
+        return np.sqrt(np.maximum(sq, 0.0)), owners, counts
+
+def match_encodings(
+    target_encodings: List[np.ndarray],
+    gallery_encodings: List[List[np.ndarray]],
+    tolerance: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized matcher. gallery_encodings holds the face encodings of each image
+    (possibly empty). Returns (best_distance, is_match) per image against the closest
+    target; images without faces get +inf / False.
+    """
+    best = np.full(len(gallery_encodings), np.inf, dtype=np.float32)
+    distances, owners, _ = _face_distance_matrix(target_encodings, gallery_encodings)
+    if distances.size:
+        # Nearest target per face, then reduce faces -> owning image
+        np.minimum.at(best, owners, distances.min(axis=1))
+    return best, best <= tolerance
+
+def _distinct_faces_match(hit: np.ndarray) -> bool:
+    """
+    hit: (n_faces, n_people) bool for one image. True if every person can be given a
+    different face (bipartite matching by augmenting paths; tiny per image).
+    """
+    n_faces, n_people = hit.shape
+    if n_faces < n_people:
+        return False
+    person_of_face: Dict[int, int] = {}
+
+    def assign(person: int, seen: set) -> bool:
+        for face in np.flatnonzero(hit[:, person]).tolist():
+            if face in seen:
+                continue
+            seen.add(face)
+            if face not in person_of_face or assign(person_of_face[face], seen):
+                person_of_face[face] = person
+                return True
+        return False
+
+    return all(assign(person, set()) for person in range(n_people))
+
+def match_people(
+    target_encodings: List[np.ndarray],
+    gallery_encodings: List[List[np.ndarray]],
+    tolerance: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Multi-person matcher: every target encoding is one person, and the whole set is
+    matched against the gallery in the same single distance pass as match_encodings.
+    Returns (best, is_match, together):
+      best: (n_images, n_people) closest face distance per image and person (+inf if none)
+      is_match: best <= tolerance
+      together: (n_images,) every person is in the image, each matched by a different face
+    """
+    n_images, n_people = len(gallery_encodings), len(target_encodings)
+    best = np.full((n_images, n_people), np.inf, dtype=np.float32)
+    distances, owners, counts = _face_distance_matrix(target_encodings, gallery_encodings)
+    if distances.size:
+        np.minimum.at(best, owners, distances)
+    is_match = best <= tolerance
+    together = is_match.all(axis=1) if n_people else np.zeros(n_images, dtype=bool)
+
+    # Per-person best distances may come from the same face; confirm the candidates
+    if n_people > 1:
+        starts = np.concatenate(([0], np.cumsum(counts)))
+        for i in np.flatnonzero(together):
+            together[i] = _distinct_faces_match(distances[starts[i]:starts[i + 1]] <= tolerance)
+    return best, is_match, together
+
+def build_match_results(
+    target_encodings: List[np.ndarray],
+    processed: List[Tuple[str, Dict]],
+    failed_urls: List[str],
+    tolerance: float,
+    people: Optional[List[Dict]] = None,
+) -> Dict:
+    """
+    Classify processed gallery images into the API buckets.
+    processed: (url, face_data) per successfully processed image.
+    failed_urls: stored images that could not be processed (reported as without people).
+    people: description of each target encoding (see _target_people); an image is
+    "matched" when any person is in it. Per-person lists are returned under "people"
+    and images containing every person under "together_images".
+    """
+    people = people or [{"person": i} for i in range(len(target_encodings))]
+    matched, unmatched_urls_with_people, urls_without_people = [], [], list(failed_urls)
+    match_scores: List[Dict] = []
+
+    # One vectorized distance pass over every gallery face and every person
+    best, is_match, together = match_people(
+        target_encodings, [faces["encodings"] for _, faces in processed], tolerance
+    )
+    best_distances = best.min(axis=1, initial=np.inf)
+    any_match = is_match.any(axis=1)
+
+    for (url, gallery_faces), distance, matched_flag in zip(processed, best_distances, any_match):
+        metrics.FACES_PER_IMAGE.observe(len(gallery_faces["locations"]))
+        if not gallery_faces["locations"]:
+            urls_without_people.append(url)
+            continue
+        if np.isfinite(distance):
+            match_scores.append({"url": url, "distance": round(float(distance), 4), "matched": bool(matched_flag)})
+        if matched_flag:
+            matched.append((float(distance), url))
+        else:
+            unmatched_urls_with_people.append(url)
+
+    # Best (closest) matches first
+    matched.sort(key=lambda pair: pair[0])
+    match_scores.sort(key=lambda score: score["distance"])
+
+    people_results = []
+    for column, person in enumerate(people):
+        rows = np.flatnonzero(is_match[:, column])
+        rows = rows[np.argsort(best[rows, column], kind="stable")]
+        people_results.append({
+            **person,
+            "matched_images": [processed[i][0] for i in rows],
+            "match_scores": [{"url": processed[i][0], "distance": round(float(best[i, column]), 4)} for i in rows],
+        })
+    # Group photos ranked by their worst-matched person
+    rows = np.flatnonzero(together)
+    rows = rows[np.argsort(best[rows].max(axis=1, initial=0.0), kind="stable")]
+
+    metrics.IMAGES_TOTAL.inc(len(matched), bucket="matched")
+    metrics.IMAGES_TOTAL.inc(len(unmatched_urls_with_people), bucket="unmatched_with_people")
+    metrics.IMAGES_TOTAL.inc(len(urls_without_people), bucket="without_people")
+
+    return {
+        "matched_images": [url for _, url in matched],
+        "unmatched_images_with_people": unmatched_urls_with_people,
+        "images_without_people": urls_without_people,
+        "match_scores": match_scores,
+        "tolerance": tolerance,
+        "people": people_results,
+        "together_images": [processed[i][0] for i in rows],
+    }
+
+def _check_targets(targets_face_data: List[Dict]) -> None:
+    """
+    Fail the search if a target image could not be processed, rather than report (and
+    save) a gallery in which nobody matched: 503 if the encoding pool failed, else 422.
+    """
+    for target_index, target_faces in enumerate(targets_face_data):
+        if "error" in target_faces:
+            print(f"Error processing target image {target_index}: {target_faces['error']}")
+            raise HTTPException(
+                status_code=503 if target_faces.get("transient") else 422,
+                detail=f"Could not process target image {target_index}: {target_faces['error']}",
+            )
+
+def _target_encodings(target_faces: Dict) -> List[np.ndarray]:
+    _check_targets([target_faces])
+    return [target_faces["encodings"][0]] if target_faces["encodings"] else []
+
+def _target_people(targets_face_data: List[Dict], all_faces: bool = False) -> Tuple[List[np.ndarray], List[Dict]]:
+    """
+    Query faces of a search: the first face of each target image, or every face when
+    all_faces is set. Returns (encodings, people) where people[i] describes encodings[i]
+    as {"person", "target_index", "location"} (location: top, right, bottom, left).
+    """
+    _check_targets(targets_face_data)
+    encodings, people = [], []
+    for target_index, target_faces in enumerate(targets_face_data):
+        faces = list(zip(target_faces["locations"], target_faces["encodings"]))
+        for location, encoding in (faces if all_faces else faces[:1]):
+            people.append({"person": len(people), "target_index": target_index, "location": [int(v) for v in location]})
+            encodings.append(encoding)
+    return encodings, people
+
+# STREAMING INGESTION
+
+async def get_face_data(
+    content: bytes,
+    embedding_cache: Dict[str, Dict],
+    new_embeddings: Dict[str, Dict],
+    key: Optional[str] = None,
+    derivatives: bool = True,
+) -> Dict:
     """
-    Upload to Google Cloud Storage when configured. Otherwise save to local uploads directory
-    and return a URL that FastAPI serves at /uploads/...
+    Face data for one image: in-request cache, then the Mongo embedding index, then the
+    encoding engine. Freshly encoded images are recorded in new_embeddings.
+    derivatives=False: the image gets no thumbnail / face crops (targets), so the
+    encoding worker does not render them.
     """
-    if storage_client and settings.GCS_BUCKET_NAME:
+    key = key or embedding_key(content)
+    face_data = embedding_cache.get(key)
+    if face_data is None:
         try:
-            bucket = storage_client.bucket(settings.GCS_BUCKET_NAME)
-            blob_path = f"user_images/{user_id}/{int(datetime.now(timezone.utc).timestamp())}_{filename}"
-            blob = bucket.blob(blob_path)
-            blob.upload_from_string(file_content, content_type='image/jpeg')
-            return blob.public_url
+            face_data = (await load_embeddings([key])).get(key)
         except Exception as e:
-            print(f"CRITICAL: Failed to upload {filename} to GCS. Error: {e}")
-          
+            print("Warning: failed to load face embeddings:", e)
+    metrics.EMBEDDING_CACHE_TOTAL.inc(result="miss" if face_data is None else "hit")
+    if face_data is None:
+        face_data = (await encoding_engine.encode_async([content], derivatives))[0]
+        if "error" not in face_data:
+            new_embeddings[key] = face_data
+    if "error" not in face_data:
+        embedding_cache[key] = face_data
+    return face_data
+
+async def _ingest_one(
+    index: int,
+    upload: UploadFile,
+    user_id: str,
+    embedding_cache: Dict[str, Dict],
+    new_embeddings: Dict[str, Dict],
+) -> Optional[Tuple[int, str, str, Dict, str, Optional[Dict]]]:
+    filename = upload.filename or "unknown"
     try:
-        user_dir = os.path.join(UPLOAD_DIR, str(user_id))
-        os.makedirs(user_dir, exist_ok=True)
-        safe_filename = f"{int(datetime.now(timezone.utc).timestamp())}_{filename}"
-        file_path = os.path.join(user_dir, safe_filename)
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-        # Build an absolute URL to the uploaded file using APP_BASE_URL
-        public_url = f"{settings.APP_BASE_URL}/uploads/{user_id}/{safe_filename}"
-        return public_url
+        content = await upload.read()
     except Exception as e:
-        print(f"CRITICAL: Failed to save {filename} locally. Error: {e}")
-        raise IOError(f"Failed to upload {filename} to storage.")
+        print(f"Warning: failed to read gallery file {filename}: {e}")
+        return None
+    finally:
+        await upload.close()
 
+    digest = content_hash(content)
+    key = embedding_key(content, digest)
+    # Store and encode concurrently; storage I/O stays off the encoding path
+    stored, face_data = await asyncio.gather(
+        image_store.store_async(content, filename, user_id, digest),
+        get_face_data(content, embedding_cache, new_embeddings, key),
+        return_exceptions=True,
+    )
+    if isinstance(face_data, BaseException):
+        face_data = {"error": str(face_data)}
+    if isinstance(stored, BaseException):
+        print(f"Skipping gallery file {filename} due to error: {stored}")
+        return None
+    url = stored
+    derivative_urls = None
+    if "error" in face_data:
+        print(f"Skipping gallery file {filename} due to error: {face_data['error']}")
+    elif settings.DERIVATIVES_ENABLED:
+        try:
+            derivative_urls = await save_derivatives(content, face_data, user_id, digest)
+        except Exception as e:
+            print(f"Warning: failed to store thumbnails of {filename}: {e}")
+    return index, filename, url, face_data, key, derivative_urls
 
-# CORE LOGIC (CPU-INTENSIVE)
+async def ingest_gallery(
+    uploads: List[UploadFile],
+    user_id: str,
+    embedding_cache: Dict[str, Dict],
+    new_embeddings: Dict[str, Dict],
+    max_in_flight: Optional[int] = None,
+) -> AsyncIterator[Tuple[int, str, str, Dict, str, Optional[Dict]]]:
+    """
+    Read, encode and store gallery files one at a time, yielding
+    (index, filename, url, face_data, embedding_key, derivative_urls) as each one finishes
+    (completion order); derivative_urls is save_derivatives' result or None. At most max_in_flight files (settings.INGEST_MAX_IN_FLIGHT) are
+    held in memory at once; each file's bytes are dropped as soon as it is stored.
+    Failed images are yielded with face_data = {"error": str}; unreadable ones are skipped.
+    """
+    slots = asyncio.Semaphore(max_in_flight or settings.INGEST_MAX_IN_FLIGHT)
+
+    async def run(index: int, upload: UploadFile):
+        async with slots:
+            return await _ingest_one(index, upload, user_id, embedding_cache, new_embeddings)
+
+    tasks = [asyncio.ensure_future(run(index, upload)) for index, upload in enumerate(uploads)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            if item is not None:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
 
-def _process_image(file_content: bytes) -> np.ndarray:
-    image = Image.open(io.BytesIO(file_content))
-    image = ImageOps.exif_transpose(image)
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    return np.array(image)
+async def _spool_upload(upload: UploadFile) -> UploadFile:
+    """
+    Copy an UploadFile to a temp file that outlives the request (background jobs); the
+    request's own files are closed once its response has been sent.
+    The temp file is deleted when the copy is closed.
+    """
+    spooled = tempfile.TemporaryFile()
+    await upload.seek(0)
+    await run_in_threadpool(shutil.copyfileobj, upload.file, spooled)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename=upload.filename)
 
-def classify_and_match_gallery(target_content: bytes, gallery_items: List[Dict], user_id: str) -> Dict[str, List[str]]:
+def classify_image(
+    target_encodings: List[np.ndarray], face_data: Dict, tolerance: float
+) -> Tuple[str, Optional[float], List[int], bool]:
     """
-    gallery_items: list of {"filename": str, "content": bytes}
-    This function runs synchronously in a threadpool (CPU-bound).
+    Bucket for a single processed image: ("matched" | "unmatched_with_people" | "without_people",
+    best distance, persons found in it, whether every person is in it).
     """
-    matched_urls, unmatched_urls_with_people, urls_without_people = [], [], []
-    target_encoding = None
+    if "error" in face_data or not face_data["locations"]:
+        return "without_people", None, [], False
+    best, is_match, together = match_people(target_encodings, [face_data["encodings"]], tolerance)
+    best_distance = best[0].min(initial=np.inf)
+    distance = round(float(best_distance), 4) if np.isfinite(best_distance) else None
+    bucket = "matched" if is_match[0].any() else "unmatched_with_people"
+    return bucket, distance, np.flatnonzero(is_match[0]).tolist(), bool(together[0])
+
+async def classify_uploads(
+    targets: List[bytes],
+    uploads: List[UploadFile],
+    user_id: str,
+    tolerance: Optional[float] = None,
+    on_progress: Optional[Callable[[int, int, int], Awaitable[None]]] = None,
+    on_image: Optional[Callable[[Dict], Awaitable[None]]] = None,
+    all_target_faces: bool = False,
+) -> Dict:
+    """
+    Run a search over uploaded gallery files; returns build_match_results' buckets plus
+    "thumbnails" (see _add_derivative_urls).
+    on_progress(processed, total, matches_so_far) is awaited after every gallery file.
+    on_image(event) is awaited with {"index", "filename", "url", "bucket", "distance",
+    "people", "together", "thumbnail_url", "face_crop_urls"} as soon as each gallery file
+    is decided (completion order).
+    """
+    tolerance = settings.MATCH_TOLERANCE if tolerance is None else tolerance
+    embedding_cache: Dict[str, Dict] = {}
+    new_embeddings: Dict[str, Dict] = {}
+
+    targets_face_data = await asyncio.gather(
+        *(get_face_data(content, embedding_cache, new_embeddings, derivatives=False) for content in targets)
+    )
+    target_encodings, people = _target_people(targets_face_data, all_target_faces)
+
+    finished = []
+    matches_so_far = 0
+    async for item in ingest_gallery(uploads, user_id, embedding_cache, new_embeddings):
+        finished.append(item)
+        if on_progress is None and on_image is None:
+            continue
+        index, filename, url, face_data, _, derivative_urls = item
+        bucket, distance, found, together = classify_image(target_encodings, face_data, tolerance)
+        matches_so_far += bucket == "matched"
+        if on_image is not None:
+            await on_image({
+                "index": index, "filename": filename, "url": url, "bucket": bucket, "distance": distance,
+                "people": found, "together": together, **(derivative_urls or {}),
+            })
+        if on_progress is not None:
+            await on_progress(len(finished), len(uploads), matches_so_far)
+    finished.sort(key=lambda item: item[0]) # back to upload order
+
+    processed, failed_urls = [], []
+    for _, _, url, face_data, _, _ in finished:
+        if "error" in face_data:
+            failed_urls.append(url)
+        else:
+            processed.append((url, face_data))
 
-    # Process target image and extract encoding (if any)
+    # Index the images that were encoded for the first time
     try:
-        target_image_np = _process_image(target_content)
-        target_face_locations = face_recognition.face_locations(target_image_np)
-        print(f"[debug] target faces found: {len(target_face_locations)}")
-        if target_face_locations:
-            encs = face_recognition.face_encodings(target_image_np, known_face_locations=target_face_locations)
-            if encs:
-                target_encoding = encs[0]
+        await store_embeddings(new_embeddings)
     except Exception as e:
-        print(f"Error processing target image: {e}")
+        print("Warning: failed to store face embeddings:", e)
 
-    # Process each gallery item (already-read bytes)
-    for item in gallery_items:
-        filename = item.get("filename", "unknown")
-        content = item.get("content", b"")
-        try:
-            gallery_image_np = _process_image(content)
-            gallery_face_locations = face_recognition.face_locations(gallery_image_np)
-            print(f"[debug] gallery '{filename}' faces found: {len(gallery_face_locations)}")
-
-            # No faces in gallery image
-            if not gallery_face_locations:
-                url = upload_to_gcs(content, filename, user_id)
-                urls_without_people.append(url)
-                continue
-
-            # Faces present in gallery but no face in target => unmatched_with_people
-            if target_encoding is None:
-                url = upload_to_gcs(content, filename, user_id)
-                unmatched_urls_with_people.append(url)
-                continue
+    # Make the gallery searchable by /search/everywhere
+    try:
+        await record_user_images(
+            user_id, [(url, key, face_data) for _, _, url, face_data, key, _ in finished if "error" not in face_data]
+        )
+    except Exception as e:
+        print("Warning: failed to record user images:", e)
 
-            gallery_encodings = face_recognition.face_encodings(gallery_image_np, known_face_locations=gallery_face_locations)
-            is_match_found = False
-            for gallery_encoding in gallery_encodings:
-                # compare_faces returns list of booleans
-                matches = face_recognition.compare_faces([target_encoding], gallery_encoding)
-                if matches and matches[0]:
-                    url = upload_to_gcs(content, filename, user_id)
-                    matched_urls.append(url)
-                    is_match_found = True
-                    break
+    results = build_match_results(target_encodings, processed, failed_urls, tolerance, people)
+    return _add_derivative_urls(results, {url: urls for _, _, url, _, _, urls in finished if urls})
 
-            if not is_match_found:
-                url = upload_to_gcs(content, filename, user_id)
-                unmatched_urls_with_people.append(url)
+# FACE EMBEDDING INDEX (MongoDB)
 
-        except Exception as e:
-            print(f"Skipping gallery file {filename} due to error: {e}")
-            # If processing fails, treat as without-people fallback to preserve UX
-            try:
-                url = upload_to_gcs(content, filename, user_id)
-                urls_without_people.append(url)
-            except Exception:
-                pass
-            continue
+def _face_data_to_doc(face_data: Dict) -> Dict:
+    return {
+        "image_size": list(face_data.get("image_size") or []),
+        "locations": [list(loc) for loc in face_data["locations"]],
+        # float32 bytes: 512 bytes per face instead of a 128-element BSON array
+        "encodings": [np.asarray(enc, dtype=np.float32).tobytes() for enc in face_data["encodings"]],
+        "created_at": datetime.now(timezone.utc),
+    }
 
+def _doc_to_face_data(doc: Dict) -> Dict:
     return {
-        "matched_images": matched_urls,
-        "unmatched_images_with_people": unmatched_urls_with_people,
-        "images_without_people": urls_without_people
+        "image_size": tuple(doc.get("image_size") or ()),
+        "locations": [tuple(loc) for loc in doc.get("locations", [])],
+        "encodings": [np.frombuffer(enc, dtype=np.float32).astype(np.float64) for enc in doc.get("encodings", [])],
     }
 
+async def load_embeddings(keys: List[str]) -> Dict[str, Dict]:
+    """Fetch already-indexed images by embedding key. Returns {embedding_key: face_data}."""
+    cache = {}
+    if not keys:
+        return cache
+    with metrics.stage_timer("mongo_read"):
+        async for doc in embeddings_collection.find({"_id": {"$in": list(set(keys))}}):
+            cache[doc["_id"]] = _doc_to_face_data(doc)
+    return cache
+
+async def store_embeddings(entries: Dict[str, Dict]) -> None:
+    """Persist newly computed face data. Upserts so concurrent requests indexing the same image don't fail."""
+    if not entries:
+        return
+    ops = [
+        UpdateOne({"_id": key}, {"$setOnInsert": _face_data_to_doc(face_data)}, upsert=True)
+        for key, face_data in entries.items()
+    ]
+    with metrics.stage_timer("mongo_write"):
+        await embeddings_collection.bulk_write(ops, ordered=False)
+
+# CROSS-GALLERY FACE SEARCH
+# user_images records every processed image (with faces) a user owns, pointing at its
+# embedding doc. Each process keeps an in-memory FaceIndex per recently active user,
+# built from Mongo on first use and caught up incrementally on every search. Adding to
+# an index can retrain its partitions, so it always runs on the threadpool.
+
+face_indexes: "OrderedDict[str, Dict]" = OrderedDict()
+face_index_locks: Dict[str, asyncio.Lock] = {}
+
+def _add_to_face_index(entry: Dict, images: List[Tuple[str, str, Dict]]) -> None:
+    """Blocking: index (url, embedding_key, face_data) entries. Call from the threadpool."""
+    for url, key, face_data in images:
+        # URL first: a search may return the key as soon as it is in the index
+        entry["urls"].setdefault(key, url)
+        entry["index"].add(key, face_data["encodings"])
+
+async def record_user_images(owner: str, images: List[Tuple[str, str, Dict]]) -> None:
+    """Add (url, embedding_key, face_data) entries to the owner's searchable images."""
+    images = [(url, key, face_data) for url, key, face_data in images if face_data["encodings"]]
+    if not images:
+        return
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne(
+            {"owner": owner, "embedding_key": key},
+            {"$setOnInsert": {"url": url, "created_at": now}},
+            upsert=True,
+        )
+        for url, key, _ in images
+    ]
+    with metrics.stage_timer("mongo_write"):
+        await user_images_collection.bulk_write(ops, ordered=False)
+
+    # Keep this process's index current; other processes catch up from Mongo on their next search
+    entry = face_indexes.get(owner)
+    if entry is not None:
+        await run_in_threadpool(_add_to_face_index, entry, images)
+
+async def _catch_up_face_index(owner: str, entry: Dict) -> None:
+    query = {"owner": owner}
+    if entry["loaded_until"] is not None:
+        # created_at is taken before the write, so another process's slower write can
+        # commit an older timestamp after the watermark moved past it; re-read a window
+        # behind the watermark (already indexed records are skipped below)
+        overlap = timedelta(seconds=settings.FACE_INDEX_CATCH_UP_OVERLAP)
+        query["created_at"] = {"$gt": entry["loaded_until"] - overlap}
+    with metrics.stage_timer("mongo_read"):
+        records = [doc async for doc in user_images_collection.find(query, {"url": 1, "embedding_key": 1, "created_at": 1})]
+    records = [doc for doc in records if doc["embedding_key"] not in entry["index"]]
+    for start in range(0, len(records), 1000):
+        batch = records[start:start + 1000]
+        face_data_by_key = await load_embeddings([doc["embedding_key"] for doc in batch])
+        images = [
+            (doc["url"], doc["embedding_key"], face_data_by_key[doc["embedding_key"]])
+            for doc in batch if doc["embedding_key"] in face_data_by_key
+        ]
+        await run_in_threadpool(_add_to_face_index, entry, images)
+    if records:
+        latest = max(doc["created_at"] for doc in records)
+        if entry["loaded_until"] is None or latest > entry["loaded_until"]:
+            entry["loaded_until"] = latest
+
+def _evict_face_indexes(keep: str) -> None:
+    # Least recently used first, until every index held fits in FACE_INDEX_MAX_FACES
+    # (the one in use is kept even if it alone is larger)
+    total = sum(len(entry["index"]) for entry in face_indexes.values())
+    for owner in list(face_indexes):
+        if total <= settings.FACE_INDEX_MAX_FACES:
+            break
+        if owner == keep:
+            continue
+        total -= len(face_indexes.pop(owner)["index"])
+        face_index_locks.pop(owner, None)
+
+async def get_face_index(owner: str) -> Dict:
+    """The owner's {"index": FaceIndex, "urls": {embedding_key: url}, "loaded_until": datetime} entry."""
+    lock = face_index_locks.setdefault(owner, asyncio.Lock())
+    async with lock:
+        entry = face_indexes.get(owner)
+        if entry is None:
+            entry = {
+                "index": FaceIndex(
+                    n_probe=settings.FACE_INDEX_N_PROBE,
+                    train_threshold=settings.FACE_INDEX_TRAIN_THRESHOLD,
+                ),
+                "urls": {},
+                "loaded_until": None,
+            }
+            face_indexes[owner] = entry
+        face_indexes.move_to_end(owner)
+        await _catch_up_face_index(owner, entry)
+        _evict_face_indexes(keep=owner)
+    return entry
+
 # API ENDPOINTS
 @app.get("/")
 def root():
@@ -289,61 +913,196 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 async def read_users_me(current_user: UserInDB = Depends(get_current_user)):
     return current_user
 
-@app.post("/classify-and-match/")
-async def classify_and_find_matches(
-    target_image: UploadFile = File(...),
-    gallery_images: List[UploadFile] = File(...),
-    current_user: UserInDB = Depends(get_current_user)
-):
-    # read target bytes
-    target_content = await target_image.read()
+@app.patch("/users/me", response_model=UserBase)
+async def update_users_me(changes: UserUpdate, current_user: UserInDB = Depends(get_current_user)):
+    fields = changes.model_dump(exclude_none=True)
+    if fields:
+        with metrics.stage_timer("mongo_write"):
+            await user_collection.update_one({"email": current_user.email}, {"$set": fields})
+        invalidate_cached_user(current_user.email)
+    return await get_cached_user(current_user.email)
 
+async def store_target_image(target_content: bytes, filename: str, user_id: str) -> Optional[str]:
     # Upload target image (optional; helps persist target preview URL)
     try:
-        target_url = upload_to_gcs(target_content, target_image.filename, str(current_user.email))
+        return await image_store.store_async(target_content, filename, user_id)
     except Exception as e:
         print("Warning: failed to upload target image:", e)
-        target_url = None
+        return None
 
-    # Read gallery files into memory (bytes) here in async code, then pass plain data into the sync worker.
-    gallery_items = []
-    for gf in gallery_images:
-        try:
-            content = await gf.read()
-            gallery_items.append({"filename": gf.filename, "content": content})
-        except Exception as e:
-            print(f"Warning: failed to read gallery file {gf.filename}: {e}")
-
-    # Run CPU-bound matching in threadpool with pre-read bytes
-    results = await run_in_threadpool(
-        classify_and_match_gallery,
-        target_content,
-        gallery_items,
-        str(current_user.email)
-    )
+async def read_targets(target_image: UploadFile, target_images: Optional[List[UploadFile]]) -> List[Tuple[str, bytes]]:
+    """(filename, bytes) of target_image followed by the optional extra target_images."""
+    files = [target_image] + list(target_images or [])
+    if len(files) > settings.MAX_TARGET_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.MAX_TARGET_IMAGES} target images per search")
+    return [(f.filename, await f.read()) for f in files]
+
+async def store_target_images(targets: List[Tuple[str, bytes]], user_id: str) -> List[Optional[str]]:
+    return list(await asyncio.gather(*(store_target_image(content, filename, user_id) for filename, content in targets)))
 
+async def finalize_search(current_user: UserInDB, target_urls: List[Optional[str]], results: Dict) -> Tuple[Dict, Optional[str]]:
+    """Update saved_galleries and persist the result. Returns (api_response, result_id)."""
     # Update user's saved_galleries with matched images (if any)
     if results.get("matched_images"):
-        await user_collection.update_one(
-            {"email": current_user.email},
-            {"$addToSet": {"saved_galleries": {"$each": results["matched_images"]}}}
-        )
+        with metrics.stage_timer("mongo_write"):
+            await user_collection.update_one(
+                {"email": current_user.email},
+                {"$addToSet": {"saved_galleries": {"$each": results["matched_images"]}}}
+            )
 
-    # Build API response including target URL
+    # Build API response including target URLs (people point at the image they came from)
+    for person in results.get("people", []):
+        if "target_index" in person:
+            person["target_image_url"] = target_urls[person["target_index"]]
     api_response = {
-        "target_image_url": target_url,
+        "target_image_url": target_urls[0] if target_urls else None,
+        "target_image_urls": target_urls,
         **results
     }
 
     # Persist the result document for this user
+    inserted_id = None
     try:
         inserted_id = await save_result_for_user(str(current_user.id), api_response)
         print(f"Saved result {inserted_id} for user {current_user.email}")
     except Exception as e:
         print("Warning: failed to save result for user:", e)
 
+    return api_response, inserted_id
+
+@app.post("/classify-and-match/")
+async def classify_and_find_matches(
+    target_image: UploadFile = File(...),
+    gallery_images: List[UploadFile] = File(...),
+    target_images: Optional[List[UploadFile]] = File(None),
+    tolerance: Optional[float] = Query(None, ge=0.0, le=1.0),
+    all_target_faces: bool = Query(False),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    Find the target person in the gallery. Several people can be searched in one pass:
+    extra target_images add the first face of each, all_target_faces=true uses every face
+    of every target image. The response adds "people" (per-person matched_images) and
+    "together_images" (images containing all of them).
+    """
+    # read target bytes
+    targets = await read_targets(target_image, target_images)
+    target_urls = await store_target_images(targets, str(current_user.email))
+
+    # Gallery files are read, encoded and stored one by one (bounded in-flight)
+    results = await classify_uploads(
+        [content for _, content in targets], gallery_images, str(current_user.email), tolerance,
+        all_target_faces=all_target_faces,
+    )
+
+    api_response, _ = await finalize_search(current_user, target_urls, results)
     return api_response
 
+def _stream_line(event: Dict, fmt: str) -> str:
+    payload = json.dumps(event)
+    if fmt == "sse":
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+@app.post("/classify-and-match/stream")
+async def classify_and_stream_matches(
+    target_image: UploadFile = File(...),
+    gallery_images: List[UploadFile] = File(...),
+    target_images: Optional[List[UploadFile]] = File(None),
+    tolerance: Optional[float] = Query(None, ge=0.0, le=1.0),
+    all_target_faces: bool = Query(False),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    Same search as /classify-and-match/, but streams one event per gallery image as soon
+    as it is decided, as NDJSON (default) or server-sent events (format=sse):
+      {"type": "target", "target_image_url", "target_image_urls", "total"}
+      {"type": "image", "index", "filename", "url", "bucket", "distance", "people", "together"}  (completion order)
+      {"type": "result", ...same body as /classify-and-match/...}
+      {"type": "error", "detail": ...}
+    """
+    targets = await read_targets(target_image, target_images)
+    # The form's UploadFiles stay open until the response has been sent, so the gallery
+    # is read straight from them as the body streams
+    uploads = gallery_images
+    user_id = str(current_user.email)
+
+    async def events():
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def run():
+            try:
+                target_urls = await store_target_images(targets, user_id)
+                await queue.put({
+                    "type": "target", "target_image_url": target_urls[0], "target_image_urls": target_urls,
+                    "total": len(uploads),
+                })
+                results = await classify_uploads(
+                    [content for _, content in targets], uploads, user_id, tolerance,
+                    on_image=lambda event: queue.put({"type": "image", **event}),
+                    all_target_faces=all_target_faces,
+                )
+                api_response, _ = await finalize_search(current_user, target_urls, results)
+                await queue.put({"type": "result", **api_response})
+            except Exception as e:
+                print(f"Streaming search failed: {e}")
+                await queue.put({"type": "error", "detail": str(e)})
+            finally:
+                for upload in uploads:
+                    await upload.close()
+                await queue.put(done)
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await queue.get()
+                if event is done:
+                    break
+                yield _stream_line(event, format)
+        finally:
+            # Client disconnected: stop the search
+            task.cancel()
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/search/everywhere")
+async def search_everywhere(
+    target_image: UploadFile = File(...),
+    tolerance: Optional[float] = Query(None, ge=0.0, le=1.0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    Find the target face in every image the user has processed before (all previous
+    galleries), using the per-user face index instead of re-running detection.
+    """
+    tolerance = settings.MATCH_TOLERANCE if tolerance is None else tolerance
+    target_content = await target_image.read()
+    new_embeddings: Dict[str, Dict] = {}
+    target_encodings = _target_encodings(await get_face_data(target_content, {}, new_embeddings, derivatives=False))
+    try:
+        await store_embeddings(new_embeddings)
+    except Exception as e:
+        print("Warning: failed to store face embeddings:", e)
+
+    entry = await get_face_index(str(current_user.email))
+    hits = await run_in_threadpool(entry["index"].search, target_encodings, tolerance, limit)
+    match_scores = [
+        {"url": entry["urls"][key], "distance": round(distance, 4), "matched": True}
+        for key, distance in hits
+    ]
+    return {
+        "matched_images": [score["url"] for score in match_scores],
+        "match_scores": match_scores,
+        "tolerance": tolerance,
+        "target_faces_found": len(target_encodings),
+        "searched_images": entry["index"].n_payloads,
+        "searched_faces": len(entry["index"]),
+    }
+
 # Stored result model + helper
 class StoredResult(BaseModel):
     id: Optional[PyObjectId] = Field(alias="_id")
@@ -353,6 +1112,7 @@ class StoredResult(BaseModel):
     matched_images: List[str] = Field(default_factory=list)
     unmatched_with_people: List[str] = Field(default_factory=list)
     images_without_people: List[str] = Field(default_factory=list)
+    thumbnails: List[Dict] = Field(default_factory=list)
     raw: Optional[Dict] = None
 
     class Config:
@@ -370,30 +1130,393 @@ async def save_result_for_user(user_id: str, result: Dict) -> str:
         "matched_images": result.get("matched_images", []),
         "unmatched_with_people": result.get("unmatched_images_with_people", []),
         "images_without_people": result.get("images_without_people", []),
+        "thumbnails": result.get("thumbnails", []),
         "raw": result,
     }
-    res = await results_collection.insert_one(doc)
+    with metrics.stage_timer("mongo_write"):
+        res = await results_collection.insert_one(doc)
     return str(res.inserted_id)
 
+class ResultsPage(BaseModel):
+    items: List[StoredResult]
+    next_cursor: Optional[str] = None # pass as ?cursor= to get the next (older) page
+
+def _encode_results_cursor(doc: Dict) -> str:
+    position = f"{doc['created_at'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def _decode_results_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        created_at, _id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), ObjectId(_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # Endpoint
-@app.get("/results", response_model=List[StoredResult])
-async def list_my_results(current_user = Depends(get_current_user)):
+@app.get("/results", response_model=ResultsPage)
+async def list_my_results(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_raw: bool = Query(False),
+    current_user = Depends(get_current_user),
+):
+    """
+    The user's stored results, newest first, one page at a time (keyset pagination on
+    created_at/_id, served by the (user_id, created_at) index). The full response copy
+    in "raw" is only returned with include_raw=true.
+    """
     # current_user expected to have .id (ObjectId or str)
     uid = str(current_user.id)
-    cursor = results_collection.find({"user_id": uid}).sort("created_at", -1)
-    out = []
-    async for doc in cursor:
-        out.append(doc)
-    return out
+    query: Dict = {"user_id": uid}
+    if cursor:
+        created_at, last_id = _decode_results_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}},
+        ]
+    projection = None if include_raw else {"raw": 0}
+    with metrics.stage_timer("mongo_read"):
+        docs = await (
+            results_collection.find(query, projection)
+            .sort([("created_at", -1), ("_id", -1)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+    next_cursor = _encode_results_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return {"items": docs[:limit], "next_cursor": next_cursor}
 
-# Simple startup check to confirm MongoDB Atlas connectivity
-@app.on_event("startup")
-async def startup_db_check():
+# BACKGROUND SEARCH JOBS
+# Jobs run on an in-process asyncio queue (no external broker). Job state lives in the
+# jobs collection so any gunicorn worker can answer status requests.
+# A job is lost if its process exits (restart, scale-down) before it finishes. The owning
+# process refreshes updated_at of its jobs every JOB_HEARTBEAT_INTERVAL, so a queued or
+# running job whose updated_at is older than JOB_STALE_AFTER is reported as failed.
+# A job's gallery is spooled to temp files until it has run. On Cloud Run /tmp is in
+# memory, so the spooled bytes per process are bounded by JOB_SPOOL_MAX_BYTES.
+
+class JobStatus(BaseModel):
+    id: PyObjectId = Field(alias="_id")
+    status: str # queued | running | done | failed
+    total: int = 0
+    processed: int = 0
+    matches: int = 0
+    result_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    result: Optional[Dict] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+        json_encoders = {ObjectId: str, datetime: lambda v: v.isoformat()}
+
+job_queue: Optional[asyncio.Queue] = None
+job_workers: List[asyncio.Task] = []
+active_job_ids: set = set() # queued/running jobs owned by this process
+job_spooled_bytes = 0 # upload bytes held for this process's queued/running jobs
+
+def _as_utc(value: datetime) -> datetime:
+    # Mongo returns naive datetimes (in UTC)
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+async def _update_job(job_id: ObjectId, **fields) -> None:
+    fields["updated_at"] = datetime.now(timezone.utc)
+    with metrics.stage_timer("mongo_write"):
+        await jobs_collection.update_one({"_id": job_id}, {"$set": fields})
+
+async def _run_job(job: Dict) -> None:
+    job_id, current_user, uploads = job["id"], job["user"], job["uploads"]
+    try:
+        await _update_job(job_id, status="running")
+        last_update = 0.0
+
+        async def on_progress(processed: int, total: int, matches: int):
+            nonlocal last_update
+            # Throttle progress writes; the final state is written below regardless
+            now = time.monotonic()
+            if processed == total or now - last_update >= settings.JOB_PROGRESS_INTERVAL:
+                last_update = now
+                await _update_job(job_id, processed=processed, total=total, matches=matches)
+
+        target_urls = await store_target_images(job["targets"], str(current_user.email))
+        results = await classify_uploads(
+            [content for _, content in job["targets"]], uploads, str(current_user.email), job["tolerance"], on_progress,
+            all_target_faces=job["all_target_faces"],
+        )
+        _, result_id = await finalize_search(current_user, target_urls, results)
+        if result_id is None:
+            # GET /jobs/{id} serves the result from the results collection; without it the search is lost
+            raise RuntimeError("The search finished but its result could not be saved, please submit it again")
+        await _update_job(
+            job_id,
+            status="done",
+            processed=len(uploads),
+            matches=len(results["matched_images"]),
+            result_id=result_id,
+        )
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        await _update_job(job_id, status="failed", error=str(e))
+    finally:
+        active_job_ids.discard(job_id)
+        _release_job_spool(job["spooled_bytes"])
+        for upload in uploads:
+            await upload.close()
+
+def _upload_size(upload: UploadFile) -> int:
+    if upload.size is not None:
+        return upload.size
+    upload.file.seek(0, os.SEEK_END)
+    return upload.file.tell()
+
+def _release_job_spool(size: int) -> None:
+    global job_spooled_bytes
+    job_spooled_bytes -= size
+
+async def _job_heartbeat() -> None:
+    while True:
+        await asyncio.sleep(settings.JOB_HEARTBEAT_INTERVAL)
+        if not active_job_ids:
+            continue
+        try:
+            await jobs_collection.update_many(
+                {"_id": {"$in": list(active_job_ids)}, "status": {"$in": ["queued", "running"]}},
+                {"$set": {"updated_at": datetime.now(timezone.utc)}},
+            )
+        except Exception as e:
+            print(f"Warning: job heartbeat failed: {e}")
+
+async def _job_worker() -> None:
+    while True:
+        job = await job_queue.get()
+        try:
+            await _run_job(job)
+        except Exception as e:
+            print(f"Job worker error: {e}")
+        finally:
+            job_queue.task_done()
+
+@app.post("/jobs/classify-and-match/", status_code=status.HTTP_202_ACCEPTED)
+async def submit_classify_job(
+    target_image: UploadFile = File(...),
+    gallery_images: List[UploadFile] = File(...),
+    target_images: Optional[List[UploadFile]] = File(None),
+    tolerance: Optional[float] = Query(None, ge=0.0, le=1.0),
+    all_target_faces: bool = Query(False),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    Queue a search and return its job id immediately; poll GET /jobs/{job_id} for progress.
+    503 while this process holds too many queued jobs (JOB_QUEUE_SIZE) or too many bytes
+    of their uploads (JOB_SPOOL_MAX_BYTES); 413 if this gallery alone is larger than that.
+    """
+    global job_spooled_bytes
+    queue_full = HTTPException(status_code=503, detail="Search queue is full, try again later")
+    if job_queue is None or job_queue.full():
+        raise queue_full
+
+    targets = await read_targets(target_image, target_images)
+    spool_size = sum(len(content) for _, content in targets) + sum(_upload_size(gf) for gf in gallery_images)
+    if spool_size > settings.JOB_SPOOL_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail="Gallery is too large for a background job, use /classify-and-match/stream instead",
+        )
+    if job_spooled_bytes + spool_size > settings.JOB_SPOOL_MAX_BYTES:
+        raise queue_full
+    # Reserved before spooling so concurrent submissions cannot overshoot the bound
+    job_spooled_bytes += spool_size
+    uploads: List[UploadFile] = []
+    try:
+        for gf in gallery_images:
+            uploads.append(await _spool_upload(gf))
+
+        now = datetime.now(timezone.utc)
+        job_doc = {
+            "user_id": str(current_user.id),
+            "status": "queued",
+            "total": len(uploads),
+            "processed": 0,
+            "matches": 0,
+            "result_id": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        res = await jobs_collection.insert_one(job_doc)
+        try:
+            # Other submissions may have filled the queue while this one was spooling
+            job_queue.put_nowait({
+                "id": res.inserted_id,
+                "user": current_user,
+                "targets": targets,
+                "uploads": uploads,
+                "tolerance": tolerance,
+                "all_target_faces": all_target_faces,
+                "spooled_bytes": spool_size,
+            })
+        except asyncio.QueueFull:
+            await _update_job(res.inserted_id, status="failed", error=queue_full.detail)
+            raise queue_full
+    except BaseException:
+        _release_job_spool(spool_size)
+        for upload in uploads:
+            await upload.close()
+        raise
+    active_job_ids.add(res.inserted_id)
+    return {"job_id": str(res.inserted_id), "status": "queued", "total": len(uploads)}
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    """
+    Progress of a search job; includes the full result once status is "done". A queued or
+    running job that stopped sending heartbeats (its server process exited) is marked
+    failed here, so clients stop polling it.
+    """
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = await jobs_collection.find_one({"_id": ObjectId(job_id), "user_id": str(current_user.id)})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    now = datetime.now(timezone.utc)
+    if job["status"] in ("queued", "running") and _as_utc(job["updated_at"]) < now - timedelta(seconds=settings.JOB_STALE_AFTER):
+        lost = {"status": "failed", "error": "Job was interrupted by a server restart, please submit it again", "updated_at": now}
+        # Conditional on updated_at, so a job that just sent a heartbeat is left alone
+        res = await jobs_collection.update_one(
+            {"_id": job["_id"], "status": job["status"], "updated_at": job["updated_at"]}, {"$set": lost}
+        )
+        if res.modified_count:
+            job.update(lost)
+    if job["status"] == "done" and job.get("result_id"):
+        stored = await results_collection.find_one({"_id": ObjectId(job["result_id"])}, {"raw": 1})
+        job["result"] = (stored or {}).get("raw")
+    return job
+
+# METRICS & PROFILING
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """Prometheus text exposition for this worker process."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profiles/{profile_id}", response_class=PlainTextResponse)
+def read_profile(profile_id: str):
+    """Folded stacks of a profiled request (id from its X-Profile-Id header); feed to flamegraph.pl or speedscope."""
+    folded = metrics.PROFILES.get(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(folded)
+
+# READINESS
+# Startup work that loads models or talks to the network runs in the background, so a
+# worker accepts connections immediately; GET /ready reports when it is actually warm.
+
+readiness = {
+    "models": "loading" if settings.WARM_UP_MODELS else "lazy", # loading | warm | lazy | restarting | failed
+    "mongo": "unknown", # unknown | ok | failed
+    "storage": "gcs" if settings.GCS_BUCKET_NAME else "local", # gcs | local | local_fallback
+}
+startup_tasks: List[asyncio.Task] = []
+mongo_checked_at = 0.0 # time.monotonic() of the last MongoDB ping
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once the face models are loaded and MongoDB answered, else 503.
+    Until MongoDB has answered, a probe pings it again (at most every READY_RECHECK_INTERVAL),
+    so a transient failure at startup does not keep the worker unready.
+    """
+    if readiness["mongo"] != "ok" and time.monotonic() - mongo_checked_at >= settings.READY_RECHECK_INTERVAL:
+        await _check_db()
+    is_ready = readiness["models"] in ("warm", "lazy") and readiness["mongo"] == "ok"
+    body = {"ready": is_ready, **readiness, "encoder_processes": encoding_engine.processes}
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+async def _warm_up_models():
+    # Retried with backoff: a failed start (e.g. a pool process killed while loading) is not permanent
+    delay = 1.0
+    while True:
+        started = time.perf_counter()
+        try:
+            await run_in_threadpool(encoding_engine.start)
+        except Exception as e:
+            readiness["models"] = "failed"
+            print(f"Encoding engine: failed to start: {e}; retrying in {delay:.0f}s")
+            await run_in_threadpool(encoding_engine.shutdown)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+            continue
+        readiness["models"] = "warm"
+        print(f"Encoding engine: {encoding_engine.processes} worker process(es) ready in {time.perf_counter() - started:.1f}s")
+        return
+
+async def _check_db():
+    global mongo_checked_at
+    mongo_checked_at = time.monotonic()
+    previous = readiness["mongo"]
     try:
         # ping the server to validate connection (motor async)
-        await client.admin.command('ping')
+        await asyncio.wait_for(client.admin.command('ping'), settings.READY_PING_TIMEOUT)
+        readiness["mongo"] = "ok"
         print("MongoDB Atlas: connection OK")
     except Exception as e:
         # print error and continue; this helps debugging on startup logs
-        print(f"MongoDB Atlas: connection FAILED: {e}")
+        readiness["mongo"] = "failed"
+        if previous != "failed":
+            print(f"MongoDB Atlas: connection FAILED: {e!r}")
+
+async def _create_indexes():
+    indexes = [
+        (user_collection, [("email", 1)], {"unique": True}),
+        (results_collection, [("user_id", 1), ("created_at", -1), ("_id", -1)], {}),
+        (user_images_collection, [("owner", 1), ("embedding_key", 1)], {"unique": True}),
+        (user_images_collection, [("owner", 1), ("created_at", 1)], {}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            print(f"Warning: failed to create index {keys} on {collection.name}: {e}")
+
+async def _connect_storage():
+    try:
+        await run_in_threadpool(image_store.backend.connect)
+    except Exception:
+        readiness["storage"] = "local_fallback"
+
+@app.on_event("startup")
+async def startup_background_tasks():
+    startup_tasks.append(asyncio.create_task(_check_db()))
+    startup_tasks.append(asyncio.create_task(_create_indexes()))
+    if settings.WARM_UP_MODELS:
+        startup_tasks.append(asyncio.create_task(_warm_up_models()))
+    if isinstance(image_store.backend, GCSStorageBackend):
+        startup_tasks.append(asyncio.create_task(_connect_storage()))
+
+@app.on_event("shutdown")
+async def shutdown_background_tasks():
+    for task in startup_tasks:
+        task.cancel()
+    startup_tasks.clear()
+
+@app.on_event("shutdown")
+async def shutdown_encoding_engine():
+    await run_in_threadpool(encoding_engine.shutdown)
+
+@app.on_event("startup")
+async def startup_job_workers():
+    global job_queue
+    job_queue = asyncio.Queue(maxsize=settings.JOB_QUEUE_SIZE)
+    for _ in range(settings.JOB_WORKERS):
+        job_workers.append(asyncio.create_task(_job_worker()))
+    job_workers.append(asyncio.create_task(_job_heartbeat()))
+
+@app.on_event("shutdown")
+async def shutdown_job_workers():
+    for task in job_workers:
+        task.cancel()
+    job_workers.clear()
 
+@app.on_event("shutdown")
+async def shutdown_image_store():
+    await run_in_threadpool(image_store.shutdown)
@@ -0,0 +1,201 @@
+import bisect
+import collections
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+# Minimal in-process metrics with Prometheus text exposition (no client library).
+# Every gunicorn worker keeps its own registry, so a scrape sees the worker that served it.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += counts[-1]
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Pipeline metrics
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "findme_stage_seconds",
+    "Time spent per pipeline stage (decode, detect, encode, match, storage_upload, mongo_read, mongo_write).",
+    ["stage"],
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "findme_request_seconds", "HTTP request latency until the response starts.", ["method", "route", "status"],
+))
+IMAGES_TOTAL = REGISTRY.register(Counter(
+    "findme_images_total", "Gallery images classified, by result bucket.", ["bucket"],
+))
+FACES_PER_IMAGE = REGISTRY.register(Histogram(
+    "findme_faces_per_image", "Faces detected per processed image.", buckets=(0, 1, 2, 3, 5, 10, 20, 50),
+))
+EMBEDDING_CACHE_TOTAL = REGISTRY.register(Counter(
+    "findme_embedding_cache_total", "Embedding index lookups, by result (hit/miss).", ["result"],
+))
+STORAGE_WRITES_TOTAL = REGISTRY.register(Counter(
+    "findme_storage_writes_total", "Image store calls, by outcome (written/deduplicated).", ["outcome"],
+))
+
+def stage_timer(stage: str):
+    """with stage_timer("mongo_write"): ..."""
+    return STAGE_SECONDS.time(stage=stage)
+
+def observe_stages(timings: Dict[str, float]) -> None:
+    """EncodingEngine observer: per-image decode/detect/encode seconds."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+def observe_storage(seconds: float, written: bool) -> None:
+    """ImageStore observer."""
+    STAGE_SECONDS.observe(seconds, stage="storage_upload")
+    STORAGE_WRITES_TOTAL.inc(outcome="written" if written else "deduplicated")
+
+# SAMPLING PROFILER
+
+class StackSampler:
+    """
+    Samples the Python stacks of all threads every `interval` seconds on a background
+    thread and aggregates them as folded stacks ("a;b;c count"), the input format of
+    flamegraph.pl / speedscope. Pool worker processes are not sampled.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[str, int] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return self.folded()
+
+    # Threads parked in these files are idle (thread pools, pymongo monitors, the event loop's select)
+    IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_filename.rsplit('/', 1)[-1] in self.IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+class ProfileStore:
+    """Keeps the last `size` request profiles in memory."""
+
+    def __init__(self, size: int = 20):
+        self._profiles: Deque[Tuple[str, str]] = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, profile_id: str, folded: str) -> None:
+        with self._lock:
+            self._profiles.append((profile_id, folded))
+
+    def get(self, profile_id: str) -> Optional[str]:
+        with self._lock:
+            for pid, folded in self._profiles:
+                if pid == profile_id:
+                    return folded
+        return None
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return [pid for pid, _ in self._profiles]
+
+PROFILES = ProfileStore()
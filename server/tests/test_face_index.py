@@ -0,0 +1,112 @@
+import numpy as np
+
+from face_index import FaceIndex
+
+def _clusters(n_clusters: int, per_cluster: int, seed: int = 0, spread: float = 0.005):
+    """(vectors, cluster id per vector): tight, well separated clusters of 128-d encodings (norm ~1, like dlib's)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=0.1, size=(n_clusters, 128)).astype(np.float32)
+    labels = np.repeat(np.arange(n_clusters), per_cluster)
+    vectors = centers[labels] + rng.normal(scale=spread, size=(len(labels), 128)).astype(np.float32)
+    return vectors, labels
+
+def _build(vectors: np.ndarray, **kwargs) -> FaceIndex:
+    index = FaceIndex(**kwargs)
+    for i, vector in enumerate(vectors):
+        index.add(f"img{i}", [vector])
+    return index
+
+def test_brute_force_returns_best_distance_per_payload_closest_first():
+    index = FaceIndex()
+    query = np.zeros(128, dtype=np.float32)
+    far, near = query.copy(), query.copy()
+    far[0], near[0] = 0.5, 0.1
+    index.add("group", [far, near]) # two faces, one payload
+    index.add("other", [query + 0.03])
+    index.add("stranger", [query + 1.0])
+
+    hits = index.search([query], max_distance=0.6)
+
+    assert [payload for payload, _ in hits] == ["group", "other"]
+    assert np.isclose(hits[0][1], 0.1, atol=1e-6)
+    assert index.search([query], max_distance=0.6, limit=1) == hits[:1]
+    assert len(index) == 4 and index.n_payloads == 3
+
+def test_adding_a_payload_twice_is_ignored():
+    index = FaceIndex()
+    index.add("img", [np.ones(128)])
+    index.add("img", [np.zeros(128), np.zeros(128)])
+    assert len(index) == 1 and index.n_payloads == 1
+    assert "img" in index and "missing" not in index
+
+def test_trains_partitions_at_threshold():
+    vectors, _ = _clusters(n_clusters=10, per_cluster=20)
+    index = _build(vectors[:199], train_threshold=200)
+    assert index._centroids is None
+
+    index.add("img199", [vectors[199]])
+
+    assert index._centroids is not None
+    assert len(index._centroids) == int(np.sqrt(200))
+    # Every face sits in its nearest partition
+    distances = ((vectors[:, None, :] - index._centroids[None, :, :]) ** 2).sum(axis=2)
+    assert (index._assign[:len(index)] == distances.argmin(axis=1)).all()
+
+def test_probe_finds_every_stored_face():
+    vectors, _ = _clusters(n_clusters=10, per_cluster=30)
+    index = _build(vectors, train_threshold=100, n_probe=1)
+    assert index._centroids is not None
+
+    for i in range(0, len(vectors), 7):
+        # float32 distances: identical vectors come out within ~1e-3 of zero
+        hits = dict(index.search([vectors[i]], max_distance=0.01))
+        assert hits.get(f"img{i}", 1.0) < 0.01
+
+def test_partitioned_search_agrees_with_brute_force():
+    vectors, labels = _clusters(n_clusters=8, per_cluster=40, seed=1)
+    brute = _build(vectors, train_threshold=10**9)
+    partitioned = _build(vectors, train_threshold=100, n_probe=2)
+    assert brute._centroids is None and partitioned._centroids is not None
+
+    query = vectors[labels == 3].mean(axis=0)
+    expected = brute.search([query], max_distance=0.2, limit=1000)
+    assert {payload for payload, _ in expected} == {f"img{i}" for i in np.flatnonzero(labels == 3)}
+
+    expected_distances = dict(expected)
+
+    # Probing a few partitions may miss faces, but never invents or re-scores them
+    approximate = partitioned.search([query], max_distance=0.2, limit=1000)
+    assert approximate
+    for payload, distance in approximate:
+        assert np.isclose(distance, expected_distances[payload], atol=1e-4)
+
+    # Probing every partition finds them all
+    partitioned.n_probe = len(partitioned._centroids)
+    exhaustive = partitioned.search([query], max_distance=0.2, limit=1000)
+    assert {payload for payload, _ in exhaustive} == set(expected_distances)
+
+def test_inserts_after_training_go_to_nearest_partition():
+    vectors, _ = _clusters(n_clusters=10, per_cluster=20, seed=2)
+    index = _build(vectors, train_threshold=200, n_probe=1)
+    centroids = index._centroids
+
+    new = vectors[5] + 0.001
+    index.add("late", [new])
+
+    assert index._centroids is centroids # not retrained yet
+    nearest = ((centroids - new) ** 2).sum(axis=1).argmin()
+    assert index._assign[len(index) - 1] == nearest
+    assert index.search([new], max_distance=0.01)[0][0] == "late"
+
+def test_retrains_after_growing_by_retrain_factor():
+    vectors, _ = _clusters(n_clusters=10, per_cluster=40, seed=3)
+    index = _build(vectors[:200], train_threshold=200, retrain_factor=2.0)
+    assert index._trained_size == 200
+
+    for i in range(200, 399):
+        index.add(f"img{i}", [vectors[i]])
+    assert index._trained_size == 200
+
+    index.add("img399", [vectors[399]])
+    assert index._trained_size == 400
+    assert len(index._centroids) == int(np.sqrt(400))
@@ -0,0 +1,65 @@
+import numpy as np
+
+from main import _distinct_faces_match, build_match_results, match_people
+
+def _encoding(*values: float) -> np.ndarray:
+    encoding = np.zeros(128)
+    encoding[:len(values)] = values
+    return encoding
+
+def test_distinct_faces_match_needs_a_face_per_person():
+    assert _distinct_faces_match(np.array([[True, True], [True, True]]))
+    # One face matching both people is not a group photo
+    assert not _distinct_faces_match(np.array([[True, True], [False, False]]))
+    assert not _distinct_faces_match(np.array([[True, True]]))
+    assert not _distinct_faces_match(np.array([[True, False], [True, False]]))
+
+def test_distinct_faces_match_reassigns_along_augmenting_paths():
+    # Greedy would give face 0 to person 0 and leave person 1 without a face
+    hit = np.array([
+        [True, True, False],
+        [True, False, False],
+        [False, True, True],
+    ])
+    assert _distinct_faces_match(hit)
+    assert not _distinct_faces_match(hit[[0, 1, 1]])
+
+def test_match_people_best_distance_per_image_and_person():
+    alice, bob = _encoding(1.0), _encoding(0.0, 1.0)
+    gallery = [
+        [_encoding(1.0, 0.1), _encoding(0.1, 1.0)], # both
+        [_encoding(0.95)], # alice only
+        [], # no faces
+        [_encoding(-1.0, -1.0)], # a stranger
+    ]
+    best, is_match, together = match_people([alice, bob], gallery, tolerance=0.6)
+
+    assert best.shape == (4, 2)
+    assert np.allclose(best[0], [0.1, 0.1], atol=1e-6)
+    assert np.isclose(best[1, 0], 0.05, atol=1e-6)
+    assert np.isinf(best[2]).all()
+    assert is_match.tolist() == [[True, True], [True, False], [False, False], [False, False]]
+    assert together.tolist() == [True, False, False, False]
+
+def test_match_people_together_needs_distinct_faces():
+    # Two look-alike targets: a single face is within tolerance of both
+    first, second = _encoding(1.0), _encoding(1.0, 0.2)
+    gallery = [[_encoding(1.0, 0.1)], [_encoding(1.0, 0.1), _encoding(1.0, 0.15)]]
+    _, is_match, together = match_people([first, second], gallery, tolerance=0.6)
+
+    assert is_match.all()
+    assert together.tolist() == [False, True]
+
+def test_build_match_results_groups_people():
+    alice, bob = _encoding(1.0), _encoding(0.0, 1.0)
+    processed = [
+        ("alice.jpg", {"locations": [(0, 1, 1, 0)], "encodings": [_encoding(0.9)]}),
+        ("both.jpg", {"locations": [(0, 1, 1, 0)] * 2, "encodings": [_encoding(1.0, 0.2), _encoding(0.2, 1.0)]}),
+        ("empty.jpg", {"locations": [], "encodings": []}),
+    ]
+    results = build_match_results([alice, bob], processed, ["broken.jpg"], tolerance=0.6)
+
+    assert results["matched_images"] == ["alice.jpg", "both.jpg"]
+    assert results["images_without_people"] == ["broken.jpg", "empty.jpg"]
+    assert [person["matched_images"] for person in results["people"]] == [["alice.jpg", "both.jpg"], ["both.jpg"]]
+    assert results["together_images"] == ["both.jpg"]
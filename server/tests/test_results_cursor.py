@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+import main
+from main import _decode_results_cursor, _encode_results_cursor
+
+# Just enough of a motor collection for list_my_results: equality, $lt and $or
+# filters, exclusion projections and multi-key sorts.
+
+def _matches(doc, query):
+    for field, cond in query.items():
+        if field == "$or":
+            if not any(_matches(doc, clause) for clause in cond):
+                return False
+        elif isinstance(cond, dict):
+            if not all(op == "$lt" and doc[field] < arg for op, arg in cond.items()):
+                return False
+        elif doc.get(field) != cond:
+            return False
+    return True
+
+class _Cursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, keys):
+        for key, direction in reversed(keys): # stable sorts, least significant key first
+            self._docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length):
+        return self._docs[:length]
+
+class _Collection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        hidden = set(projection or ())
+        return _Cursor([
+            {k: v for k, v in doc.items() if k not in hidden} for doc in self.docs if _matches(doc, query)
+        ])
+
+class _User:
+    id = "user-1"
+
+def _list(cursor=None, limit=2, include_raw=False):
+    return asyncio.run(main.list_my_results(limit=limit, cursor=cursor, include_raw=include_raw, current_user=_User()))
+
+@pytest.mark.parametrize("created_at", [
+    datetime(2026, 3, 1, 12, 30, 15, 123000), # as Mongo returns it: naive UTC, millisecond precision
+    datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+])
+def test_cursor_round_trip(created_at):
+    doc = {"_id": ObjectId(), "created_at": created_at}
+    assert _decode_results_cursor(_encode_results_cursor(doc)) == (created_at, doc["_id"])
+
+def test_pages_cover_equal_timestamps_exactly_once(monkeypatch):
+    base = datetime(2026, 3, 1, 12, 0, 0)
+    created = [base + timedelta(seconds=1)] + [base] * 5 + [base - timedelta(seconds=1)]
+    docs = [{"_id": ObjectId(), "user_id": "user-1", "created_at": created_at, "raw": {}} for created_at in created]
+    others = [{"_id": ObjectId(), "user_id": "user-2", "created_at": base, "raw": {}}]
+    monkeypatch.setattr(main, "results_collection", _Collection(docs + others))
+
+    seen, cursor = [], None
+    while True:
+        page = _list(cursor)
+        seen.extend(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    expected = sorted(docs, key=lambda doc: (doc["created_at"], doc["_id"]), reverse=True)
+    assert [doc["_id"] for doc in seen] == [doc["_id"] for doc in expected]
+    assert all("raw" not in doc for doc in seen)
+
+def test_include_raw_and_last_page(monkeypatch):
+    docs = [{"_id": ObjectId(), "user_id": "user-1", "created_at": datetime(2026, 3, 1), "raw": {"n": 1}}]
+    monkeypatch.setattr(main, "results_collection", _Collection(docs))
+
+    page = _list(limit=1, include_raw=True)
+    assert page["items"][0]["raw"] == {"n": 1}
+    assert page["next_cursor"] is None
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "bm8tc2VwYXJhdG9y", "MjAyNnxub3QtYW4taWQ="])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        _decode_results_cursor(cursor)
+    assert error.value.status_code == 400